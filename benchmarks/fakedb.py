@@ -0,0 +1,67 @@
+"""
+An in-process stand-in for DBConnection which generates synthetic rows
+instead of querying a database, so the pipeline can be benchmarked without
+Postgres.
+"""
+from contextlib import contextmanager
+
+from mark.query import parseQueryColumns
+from mark.result import Result
+
+class FakeConfig(object):
+    uri = 'fake://'
+    batch_size = 1000
+    max_connections = 4
+    copy_threshold = None
+    max_cost = None
+    max_rows = None
+    guard = 'refuse'
+    guard_timeout = None
+
+def defaultGenerators(cardinality):
+    """
+    Return functions generating the value of well-known columns for row i.
+    Columns not listed here get the row number.
+    """
+    return {
+        # a partition with `cardinality` distinct values
+        'host': lambda i: u"host-{}".format(i % cardinality),
+        # one bucket per round of partitions
+        'bucket': lambda i: i // cardinality,
+        # cheap pseudo-random values
+        'value': lambda i: (i * 2654435761) % 1000,
+        'label': lambda i: u"label-{}".format(i % cardinality),
+    }
+
+class FakeConnection(object):
+    """
+    Answers every query with `rows` rows of its selected columns.
+    """
+
+    def __init__(self, rows, cardinality=100, generators=None):
+        self.config = FakeConfig()
+        self.rows = rows
+        self.generators = generators or defaultGenerators(cardinality)
+
+    def generate(self, columns):
+        makers = [self.generators.get(c.rstrip('0123456789'), int)
+                  for c in columns]
+        for i in xrange(self.rows):
+            yield tuple(make(i) for make in makers)
+
+    def execute(self, query, **kwargs):
+        return self.stream(query).materialize()
+
+    def executePrepared(self, query, params, timeout=None):
+        return self.execute(query)
+
+    def stream(self, query, batch_size=None, **kwargs):
+        columns = parseQueryColumns(query)
+        return Result(columns, self.generate(columns))
+
+    @contextmanager
+    def reserved(self):
+        yield
+
+    def cancel(self):
+        pass
@@ -0,0 +1,160 @@
+"""
+Benchmark the query pipeline, from reading the markfile to rendering the
+graph, for each graph type at several result sizes. Rows come from an
+in-process fake database. Every case runs in its own process so its peak
+memory can be measured.
+
+Usage:
+    python benchmarks/pipeline.py [--sizes 1000,100000,1000000]
+                                  [--save results.json]
+                                  [--baseline results.json --tolerance 0.2]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def markfile(width):
+    columns = ", ".join(["label"] + ["c{}".format(i) for i in range(1, width)])
+    return """
+config:
+  host: localhost
+  port: 5432
+  user: mark
+  pass: mark
+  name: mark
+
+table:
+  query: select {} from synthetic
+  stream: true
+
+spark:
+  query: select bucket, value from synthetic
+  stream: true
+  graph:
+    type: spark
+    axis: value
+
+multispark:
+  query: select host, bucket, value from synthetic
+  stream: true
+  graph:
+    type: multispark
+    partition: host
+    axis: value
+""".format(columns)
+
+class Sink(object):
+    """
+    Counts the bytes written to it.
+    """
+    size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+def runCase(graph, rows, cardinality):
+    """
+    Run a single case in this process and print its results as JSON.
+    """
+    sys.path.insert(0, root)
+    sys.path.insert(0, os.path.join(root, 'benchmarks'))
+    from fakedb import FakeConnection
+    from mark.cli import getMarkFile, writeQuery
+
+    start = time.time()
+    _, markfile, _ = getMarkFile('markfile.yml', cache=False)
+    db = FakeConnection(rows, cardinality=cardinality)
+    out = Sink()
+    writeQuery(markfile, graph, db, out)
+    elapsed = time.time() - start
+    print json.dumps({
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'output_bytes': out.size,
+    })
+
+def spawn(directory, args):
+    command = [sys.executable, os.path.abspath(__file__)] + args
+    start = time.time()
+    output = subprocess.check_output(command, cwd=directory)
+    return time.time() - start, output
+
+def compare(results, baseline, tolerance):
+    """
+    Return a description of each case slower or larger than the baseline by
+    more than the tolerated fraction.
+    """
+    regressions = []
+    for case, result in sorted(results.items()):
+        if case not in baseline:
+            continue
+        for metric in ('seconds', 'peak_rss_kb'):
+            before, after = baseline[case][metric], result[metric]
+            if before and after > before * (1 + tolerance):
+                regressions.append("{} {}: {:.3f} -> {:.3f} (+{:.0f}%)".format(
+                    case, metric, before, after,
+                    100.0 * (after - before) / before))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--graphs', default='table,spark,multispark')
+    parser.add_argument('--width', type=int, default=8,
+                        help="columns selected by the table query")
+    parser.add_argument('--cardinality', type=int, default=100,
+                        help="distinct labels and partitions")
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        graph, rows = args.case.split(':')
+        return runCase(graph, int(rows), args.cardinality)
+
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        with open(os.path.join(directory, 'markfile.yml'), 'w') as f:
+            f.write(markfile(args.width))
+        # a single row run is dominated by interpreter and import time
+        elapsed, _ = spawn(directory, ['--case', 'table:1'])
+        results['cold-start'] = {'seconds': elapsed, 'peak_rss_kb': 0}
+        print "{:<24} {:>8.3f}s".format('cold-start', elapsed)
+        for graph in args.graphs.split(','):
+            for rows in [int(size) for size in args.sizes.split(',')]:
+                case = "{}:{}".format(graph, rows)
+                _, output = spawn(directory, [
+                    '--case', case, '--cardinality', str(args.cardinality)])
+                result = json.loads(output.splitlines()[-1])
+                results[case] = result
+                print "{:<24} {:>8.3f}s {:>12.0f} rows/s {:>10} KB".format(
+                    case, result['seconds'], result['rows_per_second'],
+                    result['peak_rss_kb'])
+    finally:
+        shutil.rmtree(directory)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print "REGRESSION", regression
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
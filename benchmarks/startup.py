@@ -0,0 +1,85 @@
+"""
+Check that `mark -l` stays within a startup-time budget and never imports
+the database or rendering dependencies.
+
+Usage: python benchmarks/startup.py [--budget SECONDS] [--runs N]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+# modules only needed to run queries
+heavy_modules = ('psycopg2', 'queries', 'sqlparse', 'tabulate', 'numpy',
+                 'mark.db', 'mark.graph')
+
+markfile = """
+config:
+  host: localhost
+  port: 5432
+  user: mark
+  pass: mark
+  name: mark
+
+errors:
+  query: select error, count(*) from errors where host = '[host]' group by error
+"""
+
+# list the queries, then report which heavy modules were imported
+listing = """
+import sys
+from mark.cli import cli
+try:
+    cli(['-l', '--no-daemon'])
+except SystemExit:
+    pass
+sys.stderr.write(' '.join(m for m in {} if m in sys.modules))
+""".format(heavy_modules)
+
+def run(directory, code):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=directory,
+                               env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    _, imported = process.communicate()
+    return time.time() - start, imported.split()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', type=float, default=0.3,
+                        help="maximum median seconds for `mark -l`")
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'markfile.yml'), 'w') as f:
+            f.write(markfile)
+        # the first run fills the markfile cache
+        run(directory, listing)
+        results = [run(directory, listing) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(directory)
+
+    timings = sorted(elapsed for elapsed, _ in results)
+    median = timings[len(timings) // 2]
+    imported = sorted(set(m for _, modules in results for m in modules))
+    print "mark -l: median {:.3f}s, best {:.3f}s over {} runs (budget {:.3f}s)" \
+        .format(median, timings[0], args.runs, args.budget)
+
+    failed = False
+    if imported:
+        print "FAIL: imported {}".format(", ".join(imported))
+        failed = True
+    if median > args.budget:
+        print "FAIL: over the startup budget"
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import re
+import json
+
+import psycopg2 as psql
+
+from mark.timing import timings
+from mark.result import ColumnResult, columnNames
+
+# text-format escapes used by COPY
+copy_escapes = {
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+    '\\': '\\',
+}
+copy_escape = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))')
+
+def unescapeField(field):
+    """
+    Decode the backslash escapes of a field in COPY's text format.
+    """
+    if '\\' not in field:
+        return field
+
+    def replace(match):
+        octal, hexadecimal, char = match.groups()
+        if octal:
+            return chr(int(octal, 8))
+        if hexadecimal:
+            return chr(int(hexadecimal, 16))
+        return copy_escapes.get(char, char)
+    return copy_escape.sub(replace, field)
+
+# types decoded with a builtin rather than a psycopg2 typecaster
+builtin_casts = {
+    20: int, 21: int, 23: int, 26: int,  # int8, int2, int4, oid
+    700: float, 701: float,              # float4, float8
+}
+
+class CopyDecoder(object):
+    """
+    A file-like target for `copy_expert` which splits COPY's text output
+    into columns as each chunk arrives, then casts each column as a whole.
+    """
+
+    def __init__(self, description, cursor):
+        self.description = description
+        self.cursor = cursor
+        self.fields = [[] for _ in description]
+        self.partial = ''
+
+    def write(self, chunk):
+        lines = (self.partial + chunk).split('\n')
+        # the last line is incomplete until the next chunk arrives
+        self.partial = lines.pop()
+        fields = self.fields
+        width = len(fields)
+        for line in lines:
+            values = line.split('\t', width - 1)
+            for index in xrange(width):
+                fields[index].append(values[index])
+
+    def caster(self, type_code):
+        if type_code in builtin_casts:
+            return builtin_casts[type_code]
+        typecaster = psql.extensions.string_types.get(type_code)
+        if typecaster is None:
+            return lambda value: value.decode('utf8')
+        return lambda value: typecaster(value, self.cursor)
+
+    def result(self):
+        columns = []
+        for column, fields in zip(self.description, self.fields):
+            cast = self.caster(column.type_code)
+            columns.append([None if field == '\\N'
+                            else cast(unescapeField(field))
+                            for field in fields])
+        return ColumnResult(columnNames(self.description), columns)
+
+def copyRows(connection, query, chunk_size=1 << 20):
+    """
+    Fetch the results of the query with `COPY ... TO STDOUT`, decoding the
+    output in chunks straight into a ColumnResult.
+    """
+    query = query.strip().rstrip(';')
+    cursor = connection.cursor()
+    # learn the result columns and their types without fetching any rows
+    with timings.phase('execute'):
+        cursor.execute("select * from ({}) as results limit 0".format(query))
+    decoder = CopyDecoder(cursor.description, cursor)
+    with timings.phase('fetch'):
+        cursor.copy_expert("copy ({}) to stdout".format(query), decoder,
+                           size=chunk_size)
+        result = decoder.result()
+    timings.count('rows', len(result))
+    return result
+
+def planEstimate(plan):
+    """
+    Return the total cost and rows estimated by an `EXPLAIN (FORMAT JSON)`
+    plan.
+    """
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    top = plan[0]['Plan']
+    return top['Total Cost'], top['Plan Rows']
+
+def explainQuery(connection, query):
+    """
+    Return the planner's estimate of the query's total cost and of how many
+    rows it returns.
+    """
+    cursor = connection.cursor()
+    with timings.phase('explain'):
+        cursor.execute("explain (format json) {}".format(query))
+        plan = cursor.fetchone()[0]
+    return planEstimate(plan)
+
+def estimateRows(connection, query):
+    """
+    Return the planner's estimate of how many rows the query returns.
+    """
+    return explainQuery(connection, query)[1]
@@ -0,0 +1,243 @@
+import os
+import time
+import bisect
+import tempfile
+import hashlib
+import cPickle as pickle
+
+def cacheDirectory(name):
+    """
+    Return the path of a named directory under the user's cache directory.
+    """
+    base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'mark', name)
+
+def cacheKey(*parts):
+    """
+    Return a stable hex digest identifying the provided strings.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf8')
+        digest.update(part)
+        digest.update('\0')
+    return digest.hexdigest()
+
+def makeDirectory(path):
+    """
+    Create the directory at path unless it exists.
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created by another process in the meantime
+            if not os.path.isdir(path):
+                raise
+
+def writePickle(path, value):
+    """
+    Atomically replace the file at path with value pickled. Each write goes
+    through its own temporary file, so concurrent writers of the same path
+    never see each other's partial writes.
+    """
+    directory = os.path.dirname(path)
+    makeDirectory(directory)
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, path)
+    except:
+        os.remove(temp)
+        raise
+
+class ResultCache(object):
+    """
+    A directory of pickled query results. Entries expire according to the
+    ttl they are read with and the least recently used entries are evicted
+    once the directory grows past `max_size` bytes.
+    """
+
+    def __init__(self, path=None, max_size=64 * 1024 * 1024):
+        self.path = path or cacheDirectory('results')
+        self.max_size = int(max_size)
+
+    def key(self, sql, uri, params=None):
+        return cacheKey(sql, uri, repr(params))
+
+    def entryPath(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key, ttl):
+        """
+        Return the cached rows for key or None if missing or older than ttl.
+        """
+        path = self.entryPath(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if time.time() - mtime > ttl:
+                return None
+            with open(path, 'rb') as f:
+                rows = pickle.load(f)
+            # record the access time for LRU eviction, keeping the mtime
+            # which marks when the result was fetched
+            os.utime(path, (time.time(), mtime))
+            return rows
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, rows):
+        """
+        Store rows under key and evict old entries if needed.
+        """
+        writePickle(self.entryPath(key), rows)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                # still being written
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                # removed by another writer since it was listed
+                continue
+            entries.append((stat.st_atime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+class MarkfileCache(object):
+    """
+    A directory of parsed markfiles. Each entry records the mtime and hash of
+    every template file read while rendering the markfile and is only used
+    while all of them are unchanged, and for no longer than its ttl if it
+    has one.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cacheDirectory('markfiles')
+
+    def entryPath(self, filename):
+        return os.path.join(self.path, cacheKey(filename))
+
+    def isFresh(self, dependencies):
+        """
+        Check that each (mtime, hash) pair still describes its file.
+        """
+        for filename, (mtime, digest) in dependencies.items():
+            try:
+                if os.path.getmtime(filename) == mtime:
+                    continue
+                with open(filename, 'rb') as f:
+                    if cacheKey(f.read()) != digest:
+                        return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def get(self, filename):
+        """
+        Return the cached entry for the markfile or None if it is stale.
+        """
+        try:
+            with open(self.entryPath(filename), 'rb') as f:
+                entry = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        ttl = entry.get('ttl')
+        if ttl and time.time() - entry.get('created', 0) > ttl:
+            return None
+        if not self.isFresh(entry['dependencies']):
+            return None
+        return entry
+
+    def set(self, filename, dependencies, ttl=None, **entry):
+        """
+        Store the entry for the markfile along with its dependencies which
+        map each template filename to its (mtime, source) at render time.
+        The entry expires after ttl seconds if given.
+        """
+        entry['ttl'] = ttl
+        entry['created'] = time.time()
+        entry['dependencies'] = dict(
+            (name, (mtime, cacheKey(source)))
+            for name, (mtime, source) in dependencies.items())
+        writePickle(self.entryPath(filename), entry)
+
+class SeriesStore(object):
+    """
+    A directory of the rows fetched by queries with a watermark column, so
+    later runs need only fetch rows past it. Each entry is an append-only
+    file of pickled batches, each replacing the stored rows at or past the
+    watermark it was fetched from. Entries are rewritten as a single batch
+    once they hold `max_batches` batches.
+    """
+
+    def __init__(self, path=None, max_batches=32):
+        self.path = path or cacheDirectory('series')
+        self.max_batches = max_batches
+
+    def key(self, sql, uri, params=None):
+        return cacheKey(sql, uri, repr(params))
+
+    def entryPath(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, key):
+        """
+        Return the column names, the position of the watermark column and
+        the stored rows in watermark order, along with the number of
+        batches they were read from. Names are None if nothing is stored.
+        """
+        names, index, rows, batches = None, None, [], 0
+        try:
+            with open(self.entryPath(key), 'rb') as f:
+                while True:
+                    try:
+                        names, index, since, fresh = pickle.load(f)
+                    except EOFError:
+                        break
+                    rows = rowsBefore(rows, index, since) + fresh
+                    batches += 1
+        except (IOError, OSError, ValueError, IndexError,
+                pickle.UnpicklingError):
+            # a partly written batch invalidates the entry
+            return None, None, [], 0
+        return names, index, rows, batches
+
+    def append(self, key, names, index, since, rows):
+        """
+        Add rows fetched from the since watermark onwards to the entry.
+        """
+        with open(self.entryPath(key), 'ab') as f:
+            f.write(pickle.dumps((names, index, since, rows),
+                                 pickle.HIGHEST_PROTOCOL))
+
+    def write(self, key, names, index, rows):
+        """
+        Replace the entry with rows.
+        """
+        writePickle(self.entryPath(key), (names, index, None, rows))
+
+def rowsBefore(rows, index, since):
+    """
+    Return the rows, ordered by the watermark at index, whose watermark is
+    before since. No rows are before a since of None.
+    """
+    if since is None:
+        return []
+    return rows[:bisect.bisect_left([row[index] for row in rows], since)]
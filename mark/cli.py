@@ -1,31 +1,80 @@
 # -*- coding: utf-8 -*-
 
-import yaml
+import os
+import sys
+import traceback
+import bisect
+import datetime
+from operator import itemgetter
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
 import click
 
-from blessings import Terminal
-t = Terminal()
+from mark.terminal import terminal as t, ClientTerminal
 
-from mark.template import makeEnvironment, MarkfileLoader
-from mark.query import callQuery, parseQueryColumns, printQueryTable
-from mark.graph import graphs, TableGraph
-from mark.db import DBConfig, DBConnection
-from mark.utils import parseArgumentCall
+from mark.template import makeEnvironment, makeBytecodeCache, prefetchCommands, MarkfileLoader
+from mark.query import callQuery, bindQuery, sweepQuery, parseQueryColumns, printQueryTable, queryParametersFromMapping, useBytecodeCache
+from mark.pushdown import pushdownQuery, watermarkQuery, limitQuery
+from mark.cache import ResultCache, MarkfileCache, SeriesStore, cacheDirectory, rowsBefore
+from mark.utils import parseArgumentCall, parseSweep, LazyModule
+from mark.result import Result
+from mark.shards import ShardSet, orderBy, concatenate, mergeOrdered, reaggregate, aggregators
+from mark.sample import percentages, sampleQuery, estimatedColumns, scaleResult
+from mark.watch import watch, preview
+from mark.pager import pager
+from mark.progress import Progress, cancellable
+from mark.output import encoders
+from mark.daemon import socketPath, serve, send
+from mark.timing import timings, profiling
 from mark.errors import MarkError, CLIError, MarkfileError, QueryError, TemplateVariableError
 
-def getMarkFile(markfile, **kwargs):
+# graphing and database modules pull in numpy, tabulate and psycopg2 so they
+# are only imported when a query is actually run
+yaml = LazyModule('yaml')
+graphing = LazyModule('mark.graph')
+database = LazyModule('mark.db')
+
+def getMarkFile(markfile, cache=True, **kwargs):
     """
     Search for the specified Markfile and load it as a Jinja2 template. Return the
-    result parsed as YAML along with the filename.
+    result parsed as YAML along with the filename and the parameters of each
+    query. Unless the markfile uses volatile `popen` output the result is
+    cached until one of the template files it was rendered from changes, or
+    the shortest `ttl` of its `popen` output passes.
     """
     try:
-        # the MarkfileLoader will recursively search parent directories
-        # for the named template file
-        env = makeEnvironment(loader=MarkfileLoader())
-        t = env.get_template(markfile)
-        r = t.render() # no external context is needed
-        return t.filename, yaml.load(r)
+        with timings.phase('markfile'):
+            # the MarkfileLoader will recursively search parent directories
+            # for the named template file
+            loader = MarkfileLoader()
+            filename = loader.findFilename(markfile)
+            compiled = MarkfileCache() if cache else None
+            entry = compiled.get(filename) if compiled else None
+            if entry is not None:
+                return filename, entry['markfile'], entry['parameters']
+
+            env = makeEnvironment(loader=loader, bytecode_cache=(
+                makeBytecodeCache() if cache else None))
+            if cache:
+                env.popen_cache = ResultCache(path=cacheDirectory('popen'))
+            # run all the markfile's commands at once before rendering
+            source, _, _ = loader.get_source(env, markfile)
+            prefetchCommands(env, source)
+            t = env.get_template(markfile)
+            r = t.render() # no external context is needed
+            data = yaml.load(r)
+            # only query-specifications have parameters, other keys may be
+            # anchors or scalars
+            queries = dict((k, v) for k, v in data.items()
+                           if k != 'config' and isinstance(v, dict)
+                           and 'query' in v)
+            parameters = queryParametersFromMapping(queries)
+            if compiled and not env.volatile:
+                compiled.set(filename, loader.sources, ttl=env.ttl,
+                             markfile=data, parameters=parameters)
+            return filename, data, parameters
     except IOError:
         msg = "Markfile `{}` could not be found."
         raise CLIError(msg.format(markfile))
@@ -42,11 +91,13 @@ def getSpec(markfile, name):
         raise CLIError(msg.format(name))
     return markfile[name]
 
-def getQuery(spec, name, args, kwargs):
+def getQuery(spec, name, args, kwargs, sweep=None):
     """
     Parse and render the query-specification using the provided args and kwargs
     as context for the rendering. If all required variables in the query are
-    not provided raise a QueryError.
+    not provided raise a QueryError. Return the query along with the values
+    of its bind parameters, which is None unless the query-specification sets
+    `bind` or parameters are swept.
     """
 
     if 'query' not in spec:
@@ -56,13 +107,15 @@ def getQuery(spec, name, args, kwargs):
     try:
         # render the query template using the args and kwargs
         query_template = spec['query']
-        query = callQuery(query_template, args, kwargs)
+        with timings.phase('template'):
+            if spec.get('bind', False) or sweep:
+                return bindQuery(query_template, args, kwargs, sweep)
+            return callQuery(query_template, args, kwargs), None
     except TemplateVariableError as e:
         # the args and kwargs were not sufficient to satisfy all
         # required parameters of the query
         msg = "Query `{}` requires missing `{}` parameter."
         raise QueryError(msg.format(name, e.variable))
-    return query
 
 def getGraph(name, spec, fields):
     """
@@ -71,8 +124,9 @@ def getGraph(name, spec, fields):
     """
 
     if 'graph' not in spec:
-        return TableGraph(fields, tablefmt='orgtbl')
-    graph_info = spec['graph']
+        return graphing.TableGraph(fields, tablefmt='orgtbl')
+    # copy the graph details since the same query may be called more than once
+    graph_info = dict(spec['graph'])
 
     if 'type' not in graph_info:
         msg = "`Query `{}` does not specify graph type."
@@ -80,12 +134,12 @@ def getGraph(name, spec, fields):
 
     # the name of the type of graph
     graph_type = graph_info.pop('type')
-    if graph_type not in graphs:
+    if graph_type not in graphing.graphs:
         msg = "`{}` is not a valid graph type for query `{}`"
-        raise QueryError(msg.format())
+        raise QueryError(msg.format(graph_type, name))
 
     # get the specified graph class and return an instance
-    graph_cls = graphs[graph_type]
+    graph_cls = graphing.graphs[graph_type]
     return graph_cls(fields, **graph_info)
 
 def getDBConfig(markfile):
@@ -97,64 +151,771 @@ def getDBConfig(markfile):
         msg = "Markfile is missing `config` section."
         raise MarkfileError(msg)
     config = markfile['config']
+    if config.get('shards') and 'host' not in config:
+        # shards needn't share a host with the config section
+        config = shardConfig(config, config['shards'][0])
+    return makeDBConfig(config)
+
+def makeDBConfig(config):
+    """
+    Return a DBConfig from a config section.
+    """
     args = []
     for attr in ('host', 'port', 'user', 'pass', 'name'):
         if attr not in config:
             msg = "Markfile `config` section has no `{}` key."
             raise MarkfileError(msg.format(attr))
         args.append(config[attr])
-    return DBConfig(*args)
+    kwargs = {}
+    for attr in ('batch_size', 'max_connections', 'copy_threshold',
+                 'max_cost', 'max_rows', 'guard', 'guard_timeout'):
+        if attr in config:
+            kwargs[attr] = config[attr]
+    return database.DBConfig(*args, **kwargs)
+
+def shardConfig(config, shard):
+    """
+    Return the config section with the keys a shard overrides.
+    """
+    if not isinstance(shard, dict):
+        shard = {'host': shard}
+    shard_config = dict(config)
+    shard_config.update(shard)
+    return shard_config
+
+def getShards(markfile, db_config):
+    """
+    Return a ShardSet for the shards listed in the markfile config, or None
+    if there are none. Each shard is a host name, or a mapping of the
+    config keys it overrides along with an optional `label`.
+    """
+    config = markfile['config']
+    if not config.get('shards'):
+        return None
+    shards = []
+    for shard in config['shards']:
+        shard_config = shardConfig(config, shard)
+        label = shard_config.get('label', shard_config['host'])
+        db = database.DBConnection(makeDBConfig(shard_config))
+        shards.append((label, db))
+    return ShardSet(shards, db_config, config.get('shard_timeout'))
+
+def getResultCache(markfile):
+    """
+    Return the result cache, sized by the optional `cache_size` config key.
+    """
+    config = markfile.get('config', {})
+    if 'cache_size' in config:
+        return ResultCache(max_size=config['cache_size'])
+    return ResultCache()
+
+def useCopy(db, spec, query, estimate=None):
+    """
+    Decide whether to fetch the results of the query in bulk with COPY,
+    either because the query-specification sets `fetch: copy` or because
+    the planner expects more rows than the `copy_threshold` config key.
+    The planner is only asked if there is no estimate already.
+    """
+    fetch = spec.get('fetch', 'auto')
+    if fetch != 'auto':
+        return fetch == 'copy'
+    threshold = db.config.copy_threshold
+    if not threshold:
+        return False
+    if estimate is None:
+        estimate = db.estimateRows(query)
+    return estimate > threshold
+
+def getLimits(db, spec):
+    """
+    Return the `max_cost` and `max_rows` limits of the query-specification,
+    or else of the config section.
+    """
+    return (spec.get('max_cost', db.config.max_cost),
+            spec.get('max_rows', db.config.max_rows))
+
+def exceededLimits(cost, rows, max_cost, max_rows):
+    """
+    Return a description of each limit the planner's estimates exceed.
+    """
+    exceeded = []
+    if max_cost and cost > float(max_cost):
+        exceeded.append("max_cost {}".format(max_cost))
+    if max_rows and rows > int(max_rows):
+        exceeded.append("max_rows {}".format(max_rows))
+    return exceeded
+
+def formatEstimate(cost, rows):
+    return "cost {:,.0f} and {:,} rows".format(cost, int(rows))
+
+def guardQuery(db, spec, query, params=None):
+    """
+    Compare the planner's estimate of the query's cost and rows with its
+    limits. Past either limit the `guard` setting of the query-specification
+    or config decides whether to refuse to run the query (the default),
+    warn and run it anyway, run it with a LIMIT of `max_rows`, or run it
+    with a statement timeout of `guard_timeout` seconds. Return the query
+    to run, the timeout to run it with and the estimated rows, if known.
+    """
+    max_cost, max_rows = getLimits(db, spec)
+    if not (max_cost or max_rows):
+        return query, None, None
+    cost, rows = db.explain(query, params)
+    exceeded = exceededLimits(cost, rows, max_cost, max_rows)
+    if not exceeded:
+        return query, None, rows
+
+    guard = spec.get('guard', db.config.guard)
+    timeout = spec.get('guard_timeout', db.config.guard_timeout)
+    if guard not in ('refuse', 'warn', 'limit', 'timeout'):
+        msg = "`guard` must be refuse, warn, limit or timeout, not `{}`."
+        raise QueryError(msg.format(guard))
+    msg = "Query's estimated {} is over {}".format(
+        formatEstimate(cost, rows), " and ".join(exceeded))
+    if guard == 'warn':
+        sys.stderr.write(t.yellow(msg + ", running it anyway.") + "\n")
+        return query, None, rows
+    if guard == 'limit' and max_rows:
+        return limitQuery(query, int(max_rows)), None, min(rows, max_rows)
+    if guard == 'timeout' and timeout:
+        return query, timeout, rows
+    raise QueryError(msg + ", refusing to run it.")
+
+def executeQuery(db, spec, query, params=None):
+    """
+    Execute the query, streaming rows from a server-side cursor if the
+    query-specification asks for it or fetching them in bulk with COPY.
+    Queries with bind parameters are prepared and executed with params.
+    Queries are checked against any cost limits first, on the connection
+    they then run on. The database cancels statements running longer than
+    the query-specification's `timeout`.
+    """
+    try:
+        with db.reserved():
+            query, timeout, estimate = guardQuery(db, spec, query, params)
+            if spec.get('timeout'):
+                timeout = min(timeout or spec['timeout'], spec['timeout'])
+            if params is not None:
+                return db.executePrepared(query, params, timeout=timeout)
+            if useCopy(db, spec, query, estimate):
+                return db.copy(query, timeout=timeout)
+            if spec.get('stream', False):
+                return db.stream(query, batch_size=spec.get('batch_size'),
+                                 timeout=timeout)
+            return db.execute(query, timeout=timeout)
+    except database.QueryCanceledError as e:
+        msg = "Query was cancelled: {}."
+        raise QueryError(msg.format(str(e).strip()))
+
+def trimWindow(rows, index, window):
+    """
+    Return the rows, ordered by the watermark at index, no more than window
+    seconds, or units, before the last watermark.
+    """
+    if not window or not rows:
+        return rows
+    last = rows[-1][index]
+    span = window
+    if isinstance(last, (datetime.date, datetime.datetime)):
+        span = datetime.timedelta(seconds=window)
+    start = bisect.bisect_left([row[index] for row in rows], last - span)
+    return rows[start:]
+
+def fetchIncremental(db, spec, query, params, store, refresh=False):
+    """
+    Return the Result of a query whose `watermark` column only ever grows.
+    Rows are kept in the series store, so only rows at or past the last
+    stored watermark are fetched and merged with them. Rows with the last
+    watermark are fetched again since more may have arrived for it.
+    """
+    column = spec['watermark']
+    window = spec.get('window')
+    key = store.key(query, db.config.uri, params)
+    names, index, rows, batches = store.load(key)
+    if refresh or not rows:
+        result = executeQuery(db, spec, query, params)
+        index = result.index(column)
+        # rows without a watermark could never be fetched again
+        rows = sorted((row for row in result if row[index] is not None),
+                      key=itemgetter(index))
+        rows = trimWindow(rows, index, window)
+        store.write(key, result.names, index, rows)
+        return Result(result.names, rows)
+
+    since = rows[-1][index]
+    sql = watermarkQuery(query, column, len(params or ()) + 1)
+    fresh = list(db.executePrepared(sql, list(params or ()) + [since]))
+    rows = trimWindow(rowsBefore(rows, index, since) + fresh, index, window)
+    if batches >= store.max_batches:
+        store.write(key, names, index, rows)
+    else:
+        store.append(key, names, index, since, fresh)
+    return Result(names, rows)
+
+def fetchRows(db, spec, query, params=None, cache=None, refresh=False,
+              store=None):
+    """
+    Return the Result of the query. If the query-specification sets a
+    `cache` ttl the result is read from, or stored in, the result cache.
+    Queries setting a `watermark` column are fetched incrementally using
+    the series store.
+    """
+    if store is not None and spec.get('watermark'):
+        return fetchIncremental(db, spec, query, params, store, refresh)
+    ttl = spec.get('cache')
+    if cache is None or not ttl:
+        return executeQuery(db, spec, query, params)
+
+    key = cache.key(query, db.config.uri, params)
+    result = None if refresh else cache.get(key, ttl)
+    # entries cached by older versions of mark hold lists of rows
+    if not isinstance(result, Result):
+        result = executeQuery(db, spec, query, params).materialize()
+        cache.set(key, result)
+    return result
+
+def mergeShards(spec, graph, query, results):
+    """
+    Merge the Results of each shard. Rows are merged in order if the query
+    has an ORDER BY clause on its selected columns, or else concatenated.
+    Tables gain a column of the shard each row came from. Graphs of a
+    label against an axis combine the axis values for each label from
+    every shard, by summing them unless the query-specification sets
+    `merge` to min, max or concat.
+    """
+    column = 'shard' if isinstance(graph, graphing.TableGraph) else None
+    names = results[0][1].names
+    order, limit = orderBy(query, names)
+    if order:
+        merged = mergeOrdered(results, order, limit, column)
+    else:
+        merged = concatenate(results, column)
+
+    how = spec.get('merge', 'sum' if hasattr(graph, 'label') else 'concat')
+    if how == 'concat':
+        return merged
+    if how not in aggregators:
+        msg = "Shard results can't be merged with `{}`."
+        raise QueryError(msg.format(how))
+    return reaggregate(merged, graph.axis, how)
+
+def fetchResult(db, spec, query, params=None, graph=None, cache=None,
+                refresh=False, store=None):
+    """
+    Return the Result of the query along with a notice for each shard which
+    failed to answer, if it was run on a set of shards.
+    """
+    if not isinstance(db, ShardSet):
+        return fetchRows(db, spec, query, params, cache, refresh, store), []
+
+    def fetch(shard):
+        return fetchRows(shard, spec, query, params, cache, refresh, store)
+
+    results, failures = db.run(fetch)
+    if not results:
+        msg = "Query failed on every shard:\n{}"
+        raise QueryError(msg.format("\n".join(failures)))
+    return mergeShards(spec, graph, query, results), failures
+
+def fetchInteractively(db, query_name, spec, fetch):
+    """
+    Call fetch, which returns a Result and notices, while showing a progress
+    line on the terminal. Ctrl-C, or the query-specification's `timeout`
+    passing, cancels the statements it is running. Return the Progress
+    along with the Result and notices.
+    """
+    progress = Progress(t, query_name)
+    rows, notices = cancellable(fetch, db.cancel, spec.get('timeout'),
+                                progress)
+    return progress, rows, notices
+
+def prepareQuery(markfile, call, sweep=None, sample=None):
+    """
+    Parse a query call from the command-line and return the query name, its
+    query-specification, the rendered sql, the values of its bind parameters
+    and the graph for its results. Given a sample percentage, queries which
+    can be sampled read only that share of their table and their returned
+    query-specification notes the `sample` and the `estimated` columns.
+    """
+    # parse the query call from the command-line
+    query_name, query_args, query_kwargs = parseArgumentCall(call)
+    # get the named query-specification
+    spec = getSpec(markfile, query_name)
+    # get a Query instance based on the query call
+    query, params = getQuery(spec, query_name, query_args, query_kwargs, sweep)
+    # get the selected column names from the query
+    with timings.phase('parse'):
+        columns = parseQueryColumns(query)
+    if sample:
+        sampled = sampleQuery(query, sample)
+        if sampled is not None:
+            spec = dict(spec, sample=sample, estimated=estimatedColumns(query))
+            query = sampled
+    # run the query once for each set of swept parameters
+    if sweep:
+        query, params = sweepQuery(query, params, sweep)
+        columns = sweep.keys() + columns
+    # get a graph instance based on the query-specification
+    graph = getGraph(query_name, spec, columns)
+    # let the database bucket the series if the graph asks for it
+    if getattr(graph, 'pushdown', None):
+        query = pushdownQuery(query, graph)
+        if 'sample' in spec and graph.aggregate == 'sum':
+            # the sum of each bucket grows with the sample too
+            spec['estimated'] = spec['estimated'] + [graph.axis]
+    return query_name, spec, query, params, graph
+
+def formatNotices(notices):
+    return "".join("\n" + t.yellow(notice) for notice in notices)
+
+def renderRows(query_name, graph, rows, notices=()):
+    """
+    Return the graphed Result, or a notice if it has no rows, as a string
+    ready for printing, followed by any other notices.
+    """
+    if rows.peek() is None: # alert that no results were returned
+        msg = "Query `{}` returned no results."
+        return t.yellow(msg.format(query_name)) + formatNotices(notices)
+    # graph the results
+    with timings.phase('render'):
+        output = graph.render(rows)
+    return "{}\n{}{}".format(t.bold_white(query_name).encode('utf8', 'replace'),
+                             output.encode('utf8', 'replace'),
+                             formatNotices(notices))
+
+def renderQuery(markfile, call, db, cache=None, refresh=False, sweep=None,
+                store=None):
+    """
+    Run a query call from the command-line and return its rendered results.
+    """
+    query_name, spec, query, params, graph = prepareQuery(markfile, call, sweep)
+    # execute the final query sql or read its cached results
+    rows, notices = fetchResult(db, spec, query, params, graph, cache=cache,
+                                refresh=refresh, store=store)
+    return renderRows(query_name, graph, rows, notices)
 
-class LazyString(basestring):
-    def __init__(self, partial):
-        basestring.__init__(self, "")
-        self.partial = partial
-        self.value = ""
+def renderSample(markfile, call, db, percentage, cache=None, refresh=False,
+                 sweep=None, store=None):
+    """
+    Run a query call from the command-line on a percentage sample of its
+    table and return its rendered results, with the columns counting or
+    summing rows scaled up and noted as estimates. Without a percentage the
+    query is run in full.
+    """
+    if percentage is None:
+        return renderQuery(markfile, call, db, cache=cache, refresh=refresh,
+                           sweep=sweep, store=store)
+    query_name, spec, query, params, graph = prepareQuery(markfile, call, sweep,
+                                                          percentage)
+    if 'sample' not in spec:
+        msg = "Query `{}` can't be sampled, waiting for its full results."
+        return t.yellow(msg.format(query_name))
+    try:
+        rows, notices = fetchResult(db, spec, query, params, graph)
+    except database.DatabaseError as e:
+        # such as when the table is a view
+        msg = "Query `{}` can't be sampled: {}"
+        return t.yellow(msg.format(query_name, str(e).strip()))
+    rows = scaleResult(rows, spec['estimated'], percentage)
+    notice = "Estimated from a {:g}% sample".format(percentage)
+    if spec['estimated']:
+        notice += ", scaling up {}".format(", ".join(spec['estimated']))
+    return renderRows(query_name, graph, rows, [notice] + notices)
+
+def writeQuery(markfile, call, db, out, cache=None, refresh=False,
+               sweep=None, store=None):
+    """
+    Run a query call from the command-line and write its results to out.
+    Graphs which can be drawn a line at a time, like tables, are written as
+    rows are fetched rather than rendered whole.
+    """
+    query_name, spec, query, params, graph = prepareQuery(markfile, call, sweep)
+    progress, rows, notices = fetchInteractively(
+        db, query_name, spec,
+        lambda: fetchResult(db, spec, query, params, graph, cache=cache,
+                            refresh=refresh, store=store))
+    if not hasattr(graph, 'lines') or rows.peek() is None:
+        rows = progress.track(rows)
+        out.write(renderRows(query_name, graph, rows, notices) + "\n")
+        return
+    out.write(t.bold_white(query_name).encode('utf8', 'replace') + "\n")
+    with timings.phase('render'):
+        for line in graph.lines(rows):
+            out.write(line.encode('utf8', 'replace') + "\n")
+    for notice in notices:
+        out.write(t.yellow(notice) + "\n")
+
+def exportQuery(markfile, call, db, out, encode, cache=None, refresh=False,
+                sweep=None, store=None):
+    """
+    Run a query call from the command-line and write its rows to out with
+    the encode function, a batch at a time as they are fetched. Notices are
+    written to stderr so they don't mix with the rows.
+    """
+    query_name, spec, query, params, graph = prepareQuery(markfile, call, sweep)
+    progress, rows, notices = fetchInteractively(
+        db, query_name, spec,
+        lambda: fetchResult(db, spec, query, params, graph, cache=cache,
+                            refresh=refresh, store=store))
+    if not out.isatty():
+        # rows written to the terminal are progress enough
+        rows = progress.track(rows)
+    with timings.phase('render'):
+        encode(rows, out, spec.get('batch_size') or db.config.batch_size)
+    for notice in notices:
+        sys.stderr.write(t.yellow(notice) + "\n")
+
+def explainCall(markfile, call, db, sweep=None):
+    """
+    Return the planner's estimates for a query call from the command-line,
+    on each shard if there are any, noting the limits they exceed.
+    """
+    query_name, spec, query, params, graph = prepareQuery(markfile, call, sweep)
+    if isinstance(db, ShardSet):
+        estimates, failures = db.run(lambda shard: shard.explain(query,
+                                                                params))
+    else:
+        estimates, failures = [(None, db.explain(query, params))], []
+    lines = [t.bold_white(query_name).encode('utf8', 'replace')]
+    for label, (cost, rows) in estimates:
+        line = "estimated " + formatEstimate(cost, rows)
+        if label is not None:
+            line = "{}: {}".format(label, line)
+        exceeded = exceededLimits(cost, rows, *getLimits(db, spec))
+        if exceeded:
+            guard = spec.get('guard', db.config.guard)
+            line += t.red(", over {} ({})".format(" and ".join(exceeded),
+                                                  guard))
+        lines.append(line)
+    return "\n".join(lines) + formatNotices(failures)
+
+def formatError(error):
+    try:
+        message = unicode(error)
+    except UnicodeDecodeError:
+        # such as a database error in the server's encoding
+        message = str(error).decode('utf8', 'replace')
+    return u" {} {}".format(t.red(u"✗ "), message.strip()).encode('utf8')
+
+def renderQueries(markfile, calls, db, cache=None, refresh=False, sweep=None,
+                  store=None):
+    """
+    Run each query call concurrently over the pooled connection, which
+    allows at most `max_connections` connections. Yield the output of each
+    call in the order the calls were given, as soon as it is available.
+    """
+    # render for the calling thread's terminal in the worker threads
+    terminal = t.current()
+
+    def render(call):
+        with t.using(terminal):
+            try:
+                return renderQuery(markfile, call, db, cache=cache,
+                                   refresh=refresh, sweep=sweep, store=store)
+            except (MarkError, database.DatabaseError) as e:
+                return formatError(e)
+
+    workers = ThreadPool(db.config.max_connections)
+    outputs = workers.imap(render, calls)
+    try:
+        while True:
+            try:
+                # waiting with a timeout leaves Ctrl-C deliverable
+                yield outputs.next(0.1)
+            except TimeoutError:
+                continue
+            except StopIteration:
+                return
+    except KeyboardInterrupt:
+        # stop the statements still running before abandoning them
+        db.cancel()
+        raise
+    finally:
+        workers.terminate()
+
+def sampleQueries(markfile, calls, db, percentages=percentages, cache=None,
+                  refresh=False, sweep=None, store=None):
+    """
+    Run the query calls on each of the growing sample percentages in turn
+    and then in full. Yield the percentage, position and rendered output of
+    each call as soon as it is available, with a percentage of None once
+    the calls are run in full.
+    """
+    for percentage in tuple(percentages) + (None,):
+        for index, call in enumerate(calls):
+            try:
+                output = renderSample(markfile, call, db, percentage,
+                                      cache=cache, refresh=refresh,
+                                      sweep=sweep, store=store)
+            except (MarkError, database.DatabaseError) as e:
+                output = formatError(e)
+            yield percentage, index, output
+
+def showSamples(markfile, calls, db, cache=None, refresh=False, sweep=None,
+                store=None):
+    """
+    Draw the results of the query calls in place as they are refined from
+    growing samples of their tables, then print their full results. Ctrl-C
+    stops refining and prints the latest results instead.
+    """
+    outputs = [""] * len(calls)
+    updates = sampleQueries(markfile, calls, db,
+                            percentages if t.is_a_tty else (),
+                            cache=cache, refresh=refresh, sweep=sweep,
+                            store=store)
+
+    def frames():
+        while True:
+            try:
+                # waiting on another thread leaves Ctrl-C deliverable
+                percentage, index, output = cancellable(lambda: next(updates),
+                                                        db.cancel)
+            except StopIteration:
+                return
+            outputs[index] = output
+            if percentage is None:
+                status = "Running in full"
+            else:
+                status = "Sampling {:g}% of each table".format(percentage)
+            header = t.bold(status + ", Ctrl-C keeps these results")
+            yield [header, ""] + "\n\n".join(outputs).splitlines()
+
+    if t.is_a_tty:
+        preview(t, frames())
+    else:
+        for _ in frames():
+            pass
+    print "\n\n".join(outputs)
+
+def watchQueries(markfile, calls, db_config, interval, sweep=None,
+                 store=None):
+    """
+    Re-run the query calls every interval seconds over a single connection,
+    or one per shard, redrawing their results in place.
+    """
+    prepared = [prepareQuery(markfile, call, sweep) for call in calls]
+    shards = getShards(markfile, db_config)
+    session = shards or database.DBSession(db_config)
+
+    def render():
+        outputs = []
+        for query_name, spec, query, params, graph in prepared:
+            def fetch():
+                rows, notices = fetchResult(session, spec, query, params,
+                                            graph, store=store)
+                return renderRows(query_name, graph, rows, notices)
+            # Ctrl-C cancels the statements rather than waiting for them
+            outputs.append(cancellable(fetch, session.cancel,
+                                       spec.get('timeout')))
+        return "\n\n".join(outputs)
+
+    try:
+        watch(t, render, interval)
+    finally:
+        if shards is None:
+            session.close()
+
+def serveDaemon(name, filename, markfile, db_config, cache=None, store=None):
+    """
+    Serve query calls from other mark processes over a Unix socket, keeping
+    the parsed markfile and a pool of connections between calls. The
+    markfile is re-read when it changes but connection details are not.
+    """
+    state = {'markfile': markfile, 'mtime': os.path.getmtime(filename)}
+    db, pool = getShards(markfile, db_config), None
+    if db is None:
+        pool = database.DBPool(db_config)
+        db = database.DBConnection(db_config, pool=pool)
+
+    def handle(request, write):
+        # render for the client's terminal rather than the daemon's
+        terminal = ClientTerminal(request.get('width'),
+                                  request.get('is_a_tty', False))
+        with t.using(terminal):
+            try:
+                respond(request, write)
+            except Exception as e:
+                if not isinstance(e, MarkError):
+                    traceback.print_exc()
+                write(formatError(e) + "\n")
+
+    def respond(request, write):
+        mtime = os.path.getmtime(filename)
+        if mtime != state['mtime']:
+            _, state['markfile'], _ = getMarkFile(name)
+            state['mtime'] = mtime
+        calls_cache = None if request.get('no_cache') else cache
+        calls_store = None if request.get('no_cache') else store
+        sweep = OrderedDict(request.get('sweep', []))
+        for output in renderQueries(state['markfile'], request['queries'], db,
+                                    cache=calls_cache,
+                                    refresh=request.get('refresh', False),
+                                    sweep=sweep, store=calls_store):
+            write(output + "\n")
+
+    path = socketPath(filename)
+    print t.bold("Serving `{}` on {}".format(filename, path))
+    try:
+        serve(path, handle)
+    finally:
+        if pool is not None:
+            pool.close()
 
-    def __str__(self):
-        if not self.value:
-            self.value = self.partial()
+def callDaemon(markfile, queries, no_cache, refresh, sweep):
+    """
+    Send the query calls to a running daemon for the markfile and print its
+    output. Return False if there is no daemon to handle them.
+    """
+    try:
+        filename = MarkfileLoader().findFilename(markfile)
+    except MarkfileError:
+        return False
+    message = {'queries': queries, 'no_cache': no_cache, 'refresh': refresh,
+               'sweep': sweep.items(), 'width': t.width,
+               'is_a_tty': t.is_a_tty}
+    return send(socketPath(filename), message, sys.stdout.write)
 
 @click.command()
 @click.option('--markfile', '-m', default='markfile.yml', metavar='',
               help="file containing queries and db details")
 @click.option('--list-queries', '-l', is_flag=True,
               help="list available queries")
-@click.argument('query', required=False)
-def cli(list_queries, query, **kwargs):
+@click.option('--no-cache', is_flag=True,
+              help="don't read or write cached results or markfiles")
+@click.option('--refresh', is_flag=True,
+              help="ignore cached results and re-cache them")
+@click.option('--watch', '-w', type=float, metavar='SECONDS',
+              help="re-run the queries every SECONDS seconds")
+@click.option('--daemon', is_flag=True,
+              help="serve query calls from other mark processes")
+@click.option('--no-daemon', is_flag=True,
+              help="run queries in-process even if a daemon is running")
+@click.option('--no-pager', is_flag=True,
+              help="don't page output longer than the terminal")
+@click.option('--timings', 'show_timings', is_flag=True,
+              help="print the time spent in each phase to stderr")
+@click.option('--timings-json', type=click.File('w'), metavar='FILE',
+              help="write phase timings as JSON to FILE (- for stdout)")
+@click.option('--profile', type=click.Choice(['cpu', 'memory']),
+              help="profile the run and print the results to stderr")
+@click.option('--sweep', '-s', multiple=True, metavar='NAME=V1,V2',
+              help="run the queries once for each value of a parameter")
+@click.option('--explain', is_flag=True,
+              help="show the planner's estimates instead of running queries")
+@click.option('--sample', is_flag=True,
+              help="preview results from growing samples of their tables")
+@click.option('--output', '-o', type=click.Choice(sorted(encoders)),
+              help="write the query's rows to stdout instead of graphing them")
+@click.argument('queries', nargs=-1)
+def cli(show_timings, timings_json, profile, **kwargs):
+    instrumented = bool(show_timings or timings_json or profile)
+    timings.enabled = instrumented
+    try:
+        with profiling(profile):
+            run(instrumented=instrumented, **kwargs)
+    finally:
+        if show_timings:
+            sys.stderr.write(timings.report() + "\n")
+        if timings_json:
+            timings.dump(timings_json)
+
+def run(list_queries, queries, no_cache, refresh, watch, daemon, no_daemon,
+        no_pager, sweep, explain, sample, output, instrumented=False,
+        **kwargs):
+    # parse any parameter sweeps from the command-line
+    sweep = parseSweep(sweep)
+
+    if output and not list_queries and (watch or len(queries) != 1):
+        msg = "--output writes the rows of exactly one query."
+        raise CLIError(msg)
+
+    if sample and (output or watch or daemon):
+        msg = "--sample can't be combined with --output, --watch or --daemon."
+        raise CLIError(msg)
+
+    # hand the query calls to a running daemon if there is one, unless the
+    # run is being measured in-process
+    if queries and not (list_queries or watch or daemon or no_daemon
+                        or instrumented or explain or sample or output):
+        if callDaemon(kwargs['markfile'], list(queries), no_cache, refresh,
+                      sweep):
+            return
+
     # get the renderered markfile
-    filename, markfile = getMarkFile(**kwargs)
+    filename, markfile, parameters = getMarkFile(cache=not no_cache, **kwargs)
+    if no_cache:
+        useBytecodeCache(False)
 
     # print queries and quit if -l is passed
     if list_queries:
-        markfile.pop('config')
-        printQueryTable(filename, markfile)
+        printQueryTable(filename, parameters)
         return
 
-    # parse the query call from the command-line
-    query_name, query_args, query_kwargs = parseArgumentCall(query)
-    # get the named query-specification
-    spec = getSpec(markfile, query_name)
-    # get a Query instance based on the query call
-    query = getQuery(spec, query_name, query_args, query_kwargs)
-    # get the selected column names from the query
-    columns = parseQueryColumns(query)
-    # get a graph instance based on the query-specification
-    graph = getGraph(query_name, spec, columns)
-    # establish a connection to the database
+    # establish how to connect to the database
     db_config = getDBConfig(markfile)
-    db = DBConnection(db_config)
-    # execute the final query sql
-    rows = db.execute(query)
-    if rows: # print the graphed results
-        print t.bold_white(query_name).encode('utf8', 'replace')
-        print graph.render(rows).encode('utf8', 'replace')
-    else: # alert that no results were returned
-        msg = "Query `{}` returned no results."
-        print t.yellow(msg.format(query_name))
+    cache = None if no_cache else getResultCache(markfile)
+    store = None if no_cache else SeriesStore()
+
+    if daemon:
+        serveDaemon(kwargs['markfile'], filename, markfile, db_config,
+                    cache=cache, store=store)
+        return
+
+    if watch:
+        watchQueries(markfile, queries, db_config, watch, sweep, store=store)
+        return
+
+    # run each query on every shard if the config lists any
+    shards = getShards(markfile, db_config)
+
+    if explain:
+        db = shards or database.DBConnection(db_config)
+        for call in queries:
+            try:
+                print explainCall(markfile, call, db, sweep)
+            except (MarkError, database.DatabaseError) as e:
+                print formatError(e)
+        return
+
+    if output:
+        db = shards or database.DBConnection(db_config)
+        exportQuery(markfile, queries[0], db, sys.stdout, encoders[output],
+                    cache=cache, refresh=refresh, sweep=sweep, store=store)
+        return
+
+    if sample:
+        db = shards or database.DBConnection(db_config)
+        showSamples(markfile, queries, db, cache=cache, refresh=refresh,
+                    sweep=sweep, store=store)
+        return
+
+    if len(queries) == 1:
+        db = shards or database.DBConnection(db_config)
+        with pager(enabled=not no_pager) as out:
+            writeQuery(markfile, queries[0], db, out, cache=cache,
+                       refresh=refresh, sweep=sweep, store=store)
+        return
+
+    # run several query calls at once over a connection pool
+    db, pool = shards, None
+    if db is None:
+        pool = database.DBPool(db_config)
+        db = database.DBConnection(db_config, pool=pool)
+    try:
+        with pager(enabled=not no_pager) as out:
+            for output in renderQueries(markfile, queries, db, cache=cache,
+                                        refresh=refresh, sweep=sweep,
+                                        store=store):
+                out.write(output + "\n")
+    finally:
+        if pool is not None:
+            pool.close()
 
 def main():
     try:
         cli()
     except MarkError as e:
-        print u" {} {}".format(t.red(u"✗ "), unicode(e)).encode('utf8')
+        print formatError(e)
+    except KeyboardInterrupt:
+        # the running statements have already been cancelled
+        sys.exit(130)
@@ -0,0 +1,108 @@
+import os
+import json
+import errno
+import socket
+import SocketServer
+
+from mark.cache import cacheKey
+from mark.errors import CLIError
+
+def socketPath(filename):
+    """
+    Return the path of the Unix socket served by the daemon for a markfile,
+    in the user's runtime directory or else a directory of their own in /tmp.
+    """
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base:
+        base = os.path.join('/tmp', "mark-{}".format(os.getuid()))
+    name = "mark-{}-{}.sock".format(os.getuid(), cacheKey(filename)[:12])
+    return os.path.join(base, name)
+
+def isPrivate(path):
+    """
+    Return whether path is owned by the current user and can't be written by
+    anyone else.
+    """
+    stat = os.lstat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 022
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+    """
+    Read a single JSON request line and write the output of the server's
+    handler back to the client before closing the connection.
+    """
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.server.handler(request, self.wfile.write)
+
+class DaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handler):
+        SocketServer.UnixStreamServer.__init__(self, path, DaemonHandler)
+        self.handler = handler
+
+def serve(path, handler):
+    """
+    Serve requests on the Unix socket at path until interrupted. handler is
+    called with each decoded request and a function for writing output.
+    """
+    directory = os.path.dirname(path)
+    try:
+        os.mkdir(directory, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    # otherwise another user could replace the socket with their own
+    if not isPrivate(directory):
+        msg = "`{}` must be a directory only you can write to."
+        raise CLIError(msg.format(directory))
+    if os.path.exists(path):
+        # a socket left behind by a daemon that didn't exit cleanly
+        os.remove(path)
+    # create the socket without access for other users from the start
+    umask = os.umask(0177)
+    try:
+        server = DaemonServer(path, handler)
+    finally:
+        os.umask(umask)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def send(path, message, write):
+    """
+    Send a request to the daemon at path and pass its output to write as it
+    arrives. Return False if no daemon is listening, or if the socket isn't
+    the current user's own.
+    """
+    try:
+        if not (isPrivate(os.path.dirname(path)) and isPrivate(path)):
+            # another user's daemon would see the calls and write the output
+            return False
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error as e:
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return False
+        raise
+    try:
+        client.sendall(json.dumps(message) + "\n")
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            write(data)
+    finally:
+        client.close()
+    return True
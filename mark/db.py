@@ -1,14 +1,119 @@
+import weakref
+import threading
+from contextlib import contextmanager
+
 import psycopg2 as psql
+from psycopg2.pool import ThreadedConnectionPool
 
 import queries
 
+from mark.timing import timings, rowBytes
+from mark.bulk import copyRows, estimateRows, explainQuery, planEstimate
+from mark.result import Result, columnNames
+
+# decode text columns as unicode
+psql.extensions.register_type(psql.extensions.UNICODE)
+psql.extensions.register_type(psql.extensions.UNICODEARRAY)
+
+# raised by statements the database fails to run
+DatabaseError = psql.DatabaseError
+# raised by statements cancelled by a timeout or by cancel()
+QueryCanceledError = psql.extensions.QueryCanceledError
+
+def recordRows(rows):
+    """
+    Count fetched rows, and their approximate size when timings are enabled.
+    """
+    timings.count('rows', len(rows))
+    if timings.enabled:
+        timings.count('bytes', rowBytes(rows))
+    return rows
+
+def prepareStatement(connection, query, prepared):
+    """
+    Prepare the query on the connection unless it already is, recording the
+    names of prepared statements in `prepared`. Return the statement name.
+    """
+    if query not in prepared:
+        name = "mark_{}".format(len(prepared))
+        cursor = connection.cursor()
+        with timings.phase('prepare'):
+            cursor.execute("PREPARE {} AS {}".format(name, query))
+        prepared[query] = name
+    return prepared[query]
+
+def statementCall(name, params):
+    """
+    Return the `EXECUTE` command for a prepared statement taking params.
+    """
+    if not params:
+        return "EXECUTE {}".format(name)
+    return "EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(params)))
+
+def executeStatement(connection, name, params):
+    """
+    Execute a prepared statement with the positional params and return its
+    Result.
+    """
+    cursor = connection.cursor()
+    with timings.phase('execute'):
+        cursor.execute(statementCall(name, params), list(params) or None)
+    with timings.phase('fetch'):
+        rows = recordRows(cursor.fetchall())
+    return Result(columnNames(cursor.description), rows)
+
+def explainStatement(connection, name, params):
+    """
+    Return the planner's estimate of a prepared statement's total cost and
+    rows when executed with params.
+    """
+    cursor = connection.cursor()
+    with timings.phase('explain'):
+        cursor.execute("explain (format json) " + statementCall(name, params),
+                       list(params) or None)
+        plan = cursor.fetchone()[0]
+    return planEstimate(plan)
+
+@contextmanager
+def statementTimeout(connection, timeout):
+    """
+    Cancel statements run on the connection within the block once they
+    have run for timeout seconds.
+    """
+    if not timeout:
+        yield
+        return
+    cursor = connection.cursor()
+    milliseconds = int(float(timeout) * 1000)
+    if not connection.autocommit:
+        # only lasts until the end of the transaction
+        cursor.execute("set local statement_timeout = %s", (milliseconds,))
+        yield
+        return
+    cursor.execute("set statement_timeout = %s", (milliseconds,))
+    try:
+        yield
+    finally:
+        cursor.execute("reset statement_timeout")
+
 class DBConfig(object):
-    def __init__(self, host, port, username, password, database):
+    def __init__(self, host, port, username, password, database,
+                 batch_size=1000, max_connections=4, copy_threshold=None,
+                 max_cost=None, max_rows=None, guard='refuse',
+                 guard_timeout=None):
         self.host = host
         self.port = int(port)
         self.username = username
         self.password = password
         self.database = database
+        self.batch_size = int(batch_size)
+        self.max_connections = int(max_connections)
+        self.copy_threshold = copy_threshold and int(copy_threshold)
+        # limits on the planner's estimates and what to do past them
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.guard = guard
+        self.guard_timeout = guard_timeout
 
     @property
     def uri(self):
@@ -25,10 +130,273 @@ class DBConfig(object):
         }
 
 
+class DBPool(object):
+    """
+    A thread-safe pool of at most `max_connections` database connections.
+    Threads wait for a connection once they are all in use.
+    """
+
+    def __init__(self, db_config):
+        self.config = db_config
+        self.pool = ThreadedConnectionPool(1, db_config.max_connections,
+                                           **db_config.asDict())
+        # psycopg2's pool raises rather than waits when it is exhausted
+        self.available = threading.BoundedSemaphore(db_config.max_connections)
+
+    @contextmanager
+    def connection(self):
+        with timings.phase('connect'):
+            self.available.acquire()
+            try:
+                connection = self.pool.getconn()
+            except Exception:
+                self.available.release()
+                raise
+        try:
+            yield connection
+        finally:
+            try:
+                # end the transaction so the connection is clean for reuse
+                connection.rollback()
+                self.pool.putconn(connection)
+            finally:
+                self.available.release()
+
+    def close(self):
+        self.pool.closeall()
+
+
+class Reservation(object):
+    """
+    A connection reserved for a block of statements along with a count of
+    its users. It is given back once the last user releases it.
+    """
+
+    def __init__(self, connection, release):
+        self.connection = connection
+        self.give_back = release
+        self.users = 1
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            done = self.users == 0
+        if done:
+            self.give_back()
+
+
 class DBConnection(object):
+    def __init__(self, db_config, pool=None):
+        self.config = db_config
+        self.pool = pool
+        # the statements prepared on each connection, which outlive a
+        # single execution when connections are pooled
+        self.prepared = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        # the connections currently in use, whose statements cancel() stops
+        self.active = set()
+        # the connection reserved by each thread, if any
+        self.local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        """
+        Yield the connection the current thread has reserved, or else one
+        from the pool if there is one, otherwise a new connection which is
+        closed afterwards.
+        """
+        reservation = getattr(self.local, 'reservation', None)
+        if reservation is not None:
+            reservation.acquire()
+            try:
+                yield reservation.connection
+            finally:
+                reservation.release()
+            return
+        if self.pool is not None:
+            with self.pool.connection() as connection, \
+                    self.tracking(connection):
+                yield connection
+            return
+        with timings.phase('connect'):
+            connection = psql.connect(**self.config.asDict())
+        try:
+            with self.tracking(connection):
+                yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def reserved(self):
+        """
+        Run every statement the current thread issues within the block on
+        the same connection, such as a query and the EXPLAIN guarding it.
+        Streamed Results keep the connection until they have been read.
+        """
+        if getattr(self.local, 'reservation', None) is not None:
+            yield
+            return
+        manager = self.connection()
+        connection = manager.__enter__()
+        reservation = Reservation(
+            connection, lambda: manager.__exit__(None, None, None))
+        self.local.reservation = reservation
+        try:
+            yield
+        finally:
+            self.local.reservation = None
+            reservation.release()
+
+    @contextmanager
+    def tracking(self, connection):
+        with self.lock:
+            self.active.add(connection)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active.discard(connection)
+
+    def cancel(self):
+        """
+        Ask the server to cancel the statements running on every connection
+        in use. They fail with a QueryCanceledError.
+        """
+        with self.lock:
+            active = list(self.active)
+        for connection in active:
+            connection.cancel()
+
+    def execute(self, query, timeout=None, **kwargs):
+        with self.connection() as connection, \
+                statementTimeout(connection, timeout):
+            cursor = connection.cursor()
+            with timings.phase('execute'):
+                cursor.execute(query, kwargs or None)
+            with timings.phase('fetch'):
+                rows = recordRows(cursor.fetchall())
+            return Result(columnNames(cursor.description), rows)
+
+    def prepare(self, connection, query):
+        with self.lock:
+            prepared = self.prepared.setdefault(connection, {})
+        return prepareStatement(connection, query, prepared)
+
+    def executePrepared(self, query, params, timeout=None):
+        """
+        Execute the query, whose parameters are bound server-side to the
+        positional params, preparing it once per connection.
+        """
+        with self.connection() as connection, \
+                statementTimeout(connection, timeout):
+            name = self.prepare(connection, query)
+            return executeStatement(connection, name, params)
+
+    def copy(self, query, timeout=None):
+        """
+        Fetch the results of the query in bulk with COPY as a ColumnResult.
+        """
+        with self.connection() as connection, \
+                statementTimeout(connection, timeout):
+            return copyRows(connection, query)
+
+    def estimateRows(self, query):
+        with self.connection() as connection:
+            return estimateRows(connection, query)
+
+    def explain(self, query, params=None):
+        """
+        Return the planner's estimate of the query's total cost and rows,
+        binding params if it takes any.
+        """
+        with self.connection() as connection:
+            if params is None:
+                return explainQuery(connection, query)
+            name = self.prepare(connection, query)
+            return explainStatement(connection, name, params)
+
+    def stream(self, query, batch_size=None, timeout=None, **kwargs):
+        """
+        Execute the query on a named server-side cursor and return a Result
+        streaming its rows. Rows are fetched from the server `batch_size` at
+        a time so only a single batch is ever held in memory.
+        """
+        rows = self.streamRows(query, batch_size, timeout, **kwargs)
+        # the first item is the description of the result columns
+        return Result(columnNames(next(rows)), rows)
+
+    def streamRows(self, query, batch_size=None, timeout=None, **kwargs):
+        """
+        Yield the cursor description once the first batch of rows has been
+        fetched, then each row.
+        """
+        batch_size = batch_size or self.config.batch_size
+        with self.connection() as connection, \
+                statementTimeout(connection, timeout):
+            cursor = connection.cursor('mark_stream')
+            cursor.itersize = batch_size
+            with timings.phase('execute'):
+                cursor.execute(query, kwargs or None)
+            with timings.phase('fetch'):
+                batch = recordRows(cursor.fetchmany(batch_size))
+            yield cursor.description
+            while batch:
+                for row in batch:
+                    yield row
+                with timings.phase('fetch'):
+                    batch = recordRows(cursor.fetchmany(batch_size))
+            cursor.close()
+
+
+class DBSession(object):
+    """
+    A single persistent connection for running the same queries repeatedly.
+    Each query is prepared once and then executed by name.
+    """
+
     def __init__(self, db_config):
         self.config = db_config
+        with timings.phase('connect'):
+            self.connection = psql.connect(**db_config.asDict())
+        # don't hold a transaction open between executions
+        self.connection.autocommit = True
+        self.prepared = {}
+
+    def execute(self, query, timeout=None):
+        return self.executePrepared(query, (), timeout)
+
+    def executePrepared(self, query, params, timeout=None):
+        name = prepareStatement(self.connection, query, self.prepared)
+        with statementTimeout(self.connection, timeout):
+            return executeStatement(self.connection, name, params)
+
+    def copy(self, query, timeout=None):
+        with statementTimeout(self.connection, timeout):
+            return copyRows(self.connection, query)
+
+    def estimateRows(self, query):
+        return estimateRows(self.connection, query)
+
+    def explain(self, query, params=None):
+        name = prepareStatement(self.connection, query, self.prepared)
+        return explainStatement(self.connection, name, params or ())
+
+    def stream(self, query, batch_size=None, timeout=None):
+        # prepared statements can't back a server-side cursor
+        return self.execute(query, timeout)
+
+    @contextmanager
+    def reserved(self):
+        # every statement already runs on the one connection
+        yield
+
+    def cancel(self):
+        self.connection.cancel()
 
-    def execute(self, query, **kwargs):
-        with queries.Session(self.config.uri) as session:
-            return list(session.query(query, **kwargs))
+    def close(self):
+        self.connection.close()
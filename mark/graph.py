@@ -1,25 +1,50 @@
-import itertools, re
-from collections import defaultdict
+from array import array
+
+import numpy
 
 from tabulate import tabulate
 
-from mark.sparkline import sparkify
+from mark.sparkline import sparkify, sparkifyRows, asSeries, terminalWidth
+from mark.pivot import pivot
+from mark.histogram import histogram, bar
+from mark.table import StreamingTable, formats
+from mark.result import ColumnResult
 from mark.errors import QueryError
 
-ansi_escape = re.compile(r'(\x1b[^m]*m)|\n|\t')
-
 class TableGraph(object):
-    def __init__(self, fields, **kwargs):
+    def __init__(self, fields, sample=100, column_width=40, **kwargs):
         # self.fields = fields
         self.fields = None
+        self.sample = sample
+        self.column_width = column_width
         self.kwargs = kwargs
 
-    def render(self, rows):
-        table = tabulate(rows, headers='keys', **self.kwargs)
-        return u"{}\n{} rows".format(table, len(rows)).encode('utf8')
+    def render(self, result):
+        # tabulate needs every row to compute column widths
+        rows = list(result)
+        table = tabulate(rows, headers=result.names, **self.kwargs)
+        return u"{}\n{} rows".format(table, len(rows))
+
+    def lines(self, result):
+        """
+        Yield the table a line at a time as rows are read from the result.
+        Results which have already been fetched, and tables in formats which
+        can't be streamed, are rendered whole.
+        """
+        tablefmt = self.kwargs.get('tablefmt', 'simple')
+        fetched = isinstance(result, ColumnResult) or \
+            isinstance(result.rows, (list, tuple))
+        if fetched or tablefmt not in formats or \
+                set(self.kwargs) - set(['tablefmt']):
+            yield self.render(result)
+            return
+        table = StreamingTable(tablefmt, self.sample, self.column_width)
+        for line in table.lines(result):
+            yield line
 
 class SparkGraph(object):
-    def __init__(self, fields, axis, minimum=None, maximum=None):
+    def __init__(self, fields, axis, minimum=None, maximum=None,
+                 width=None, aggregate='max', pushdown=None, unit=None):
         if len(fields) != 2:
             msg = "SparkGraph can only process two-column queries."
             raise QueryError(msg)
@@ -31,19 +56,63 @@ class SparkGraph(object):
         self.fields = fields
         self.axis = axis
         self.label = [f for f in fields if f != axis][0]
+        self.partition = None
         self.minimum = minimum
         self.maximum = maximum
+        self.width = width
+        self.aggregate = aggregate
+        self.pushdown = pushdown
+        self.unit = unit
+
+    def seriesWidth(self):
+        return self.width or terminalWidth()
+
+    def fits(self, labels, values, width):
+        """
+        Check whether a column per value, headed by its label, fits in width.
+        """
+        if len(values) > width:
+            return False
+        columns = [max(len(unicode(l)), len(unicode(v))) + 2
+                   for l, v in zip(labels, values)]
+        return sum(columns) <= width
 
-    def render(self, rows):
-        values = [r[self.axis] for r in rows]
-        series = sparkify(values)
-        labels = [r[str(self.label)] for r in rows]
-        return tabulate([series, values], headers=labels)
+    def render(self, result):
+        axis, label = result.index(self.axis), result.index(self.label)
+        width = self.seriesWidth()
+        values = array('d')
+        # the labels and raw values are only kept while a column each might
+        # still fit, so memory doesn't grow with the rows beyond the values
+        columns = []
+        for row in result:
+            value, last = row[axis], row[label]
+            values.append(numpy.nan if value is None else value)
+            if len(columns) <= width:
+                columns.append((last, value))
+        first = columns[0][0]
+        if len(values) <= width:
+            labels, raw = zip(*columns)
+            if self.fits(labels, raw, width):
+                series = sparkify(raw, self.minimum, self.maximum)
+                return tabulate([series, raw], headers=labels)
+
+        # too many values for a column each, so draw a single sparkline with
+        # the range of labels and values beneath it, downsampled if need be
+        values = asSeries(values)
+        series = sparkify(values, self.minimum, self.maximum,
+                          width=width, aggregate=self.aggregate)
+        count = u"{} values".format(len(values))
+        if len(values) > width:
+            count = u"{} {} values".format(len(values), self.aggregate)
+        return u"{}\n{} .. {}  ({}, min {:g}, max {:g})".format(
+            series, first, last, count, numpy.nanmin(values),
+            numpy.nanmax(values))
 
 class HistGraph(object):
-    def __init__(self, fields, axis, minimum=None, maximum=None):
-        if len(fields) != 2:
-            msg = "HistGraph can only process two-column queries."
+    def __init__(self, fields, axis, minimum=None, maximum=None, bins=20,
+                 quantile=0.99, width=None):
+        if len(fields) not in (1, 2):
+            msg = "HistGraph can only process one or two-column queries."
             raise QueryError(msg)
         if axis not in fields:
             msg = "Axis `{}` not in query columns: {}"
@@ -51,47 +120,72 @@ class HistGraph(object):
 
         self.fields = fields
         self.axis = axis
+        # a second column holds the number of times each value occurs
+        others = [f for f in fields if f != axis]
+        self.weight = others[0] if others else None
         self.minimum = minimum
         self.maximum = maximum
+        self.bins = int(bins)
+        self.quantile = float(quantile)
+        self.width = width
+
+    def barWidth(self):
+        # leave room for the bin and count columns
+        return self.width or max(terminalWidth() - 40, 10)
+
+    def render(self, result):
+        hist = histogram(result, self.axis, self.weight, self.bins,
+                         self.minimum, self.maximum, self.quantile)
+        peak = hist.counts.max()
+        scale = self.barWidth() / peak if peak > 0 else 0
+        rows = [(u"{:.4g} - {:.4g}".format(low, high), bar(count, scale),
+                 int(round(count)))
+                for low, high, count in zip(hist.edges, hist.edges[1:],
+                                            hist.counts)]
+        table = tabulate(rows, headers=(self.axis, '', 'count'))
+        total = int(round(hist.counts.sum() + hist.below + hist.above))
+        summary = u"{} values, {} below and {} above the range".format(
+            total, int(round(hist.below)), int(round(hist.above)))
+        if hist.estimated:
+            summary += u" (estimated)"
+        return u"{}\n{}".format(table, summary)
 
 class MultiSparkGraph(object):
-    def __init__(self, fields, partition, axis, minimum=None, maximum=None):
+    def __init__(self, fields, partition, axis, minimum=None, maximum=None,
+                 width=None, aggregate='max', limit=None, pushdown=None,
+                 unit=None):
         self.fields = fields
         self.partition = partition
         self.axis = axis
         self.label = [f for f in fields if f not in (axis, partition)][0]
         self.minimum = minimum
         self.maximum = maximum
+        self.width = width
+        self.aggregate = aggregate
+        self.limit = limit
+        self.pushdown = pushdown
+        self.unit = unit
+
+    def seriesWidth(self):
+        # leave room for the partition, peak and total columns
+        return self.width or max(terminalWidth() - 40, 10)
 
-    def buildPartitions(self, rows):
-        partitions = defaultdict(dict)
-        for row in rows:
-            index = row.pop(self.partition)
-            index = ansi_escape.sub('', index)
-            key = unicode(row.pop(self.label)).encode('ascii', 'replace')
-            key = ansi_escape.sub('', key)
-            value = row.pop(self.axis)
-            partitions[index][key] = value
-        superset = set(itertools.chain.from_iterable(partitions.values()))
-        superset = sorted(list(superset))
-        print superset
-        for partition, dataset in partitions.items():
-            for key in superset:
-                dataset.setdefault(key, 0)
-        return superset, partitions
-
-    def render(self, rows):
-        keys, partitions = self.buildPartitions(rows)
-        results = []
-        for partition, dataset in partitions.items():
-            values = [dataset[k] for k in keys]
-            series = sparkify(values)
-            results.append((partition, series, max(values), sum(values)))
-        results = sorted(results, cmp=lambda a,b: cmp(a[3], b[3]))
+    def render(self, result):
+        table = pivot(result, self.partition, self.label, self.axis)
+        width = self.seriesWidth()
+        # only draw the partitions which will be shown
+        chosen = table.top(self.limit)
+        matrix = table.matrix[chosen]
+        series = sparkifyRows(matrix, self.minimum, self.maximum,
+                              width=width, aggregate=self.aggregate)
+        partitions = [table.partitions[i] for i in chosen]
+        results = zip(partitions, series,
+                      numpy.nanmax(matrix, axis=1), numpy.nansum(matrix, axis=1))
         return tabulate(results, headers=(self.partition, self.axis, 'peak', 'total'))
 
 graphs = {
     'table': TableGraph,
     'spark': SparkGraph,
+    'hist': HistGraph,
     'multispark': MultiSparkGraph,
 }
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import numpy
+
+from mark.sparkline import asSeries
+
+# eighths of a block for drawing the ends of bars
+bar_chars = u" ▏▎▍▌▋▊▉█"
+
+class QuantileSketch(object):
+    """
+    Approximates the distribution of a stream of values in fixed memory as
+    at most `size` centroids, each the mean and total weight of a run of
+    neighbouring values. Centroids near the tails hold fewer values, so
+    extreme quantiles stay accurate.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.means = numpy.empty(0)
+        self.weights = numpy.empty(0)
+        self.minimum = numpy.inf
+        self.maximum = -numpy.inf
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def add(self, values, weights=None):
+        """
+        Add an array of values, each counted once or by its weight. NaN
+        values are ignored.
+        """
+        if weights is None:
+            weights = numpy.ones_like(values)
+        weights = numpy.nan_to_num(weights)
+        present = ~numpy.isnan(values)
+        values, weights = values[present], weights[present]
+        if not len(values):
+            return
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        means = numpy.concatenate([self.means, values])
+        weights = numpy.concatenate([self.weights, weights])
+        order = numpy.argsort(means, kind='mergesort')
+        self.means, self.weights = self.compress(means[order], weights[order])
+
+    def compress(self, means, weights):
+        """
+        Merge sorted centroids into at most `size` centroids.
+        """
+        if len(means) <= self.size:
+            return means, weights
+        cumulative = numpy.cumsum(weights)
+        quantiles = (cumulative - weights / 2.0) / cumulative[-1]
+        # the arcsine scale makes groups smaller towards either tail
+        scale = numpy.arcsin(2 * quantiles - 1) / numpy.pi + 0.5
+        groups = numpy.minimum(scale * self.size, self.size - 1).astype(int)
+        totals = numpy.bincount(groups, weights, minlength=self.size)
+        sums = numpy.bincount(groups, weights * means, minlength=self.size)
+        kept = totals > 0
+        return sums[kept] / totals[kept], totals[kept]
+
+    def positions(self):
+        """
+        Return the cumulative weight at each centroid, along with the
+        centroid means, bracketed by the minimum and maximum.
+        """
+        cumulative = numpy.cumsum(self.weights) - self.weights / 2.0
+        weights = numpy.concatenate([[0.0], cumulative, [self.count]])
+        means = numpy.concatenate([[self.minimum], self.means, [self.maximum]])
+        return weights, means
+
+    def quantile(self, q):
+        weights, means = self.positions()
+        return numpy.interp(q * self.count, weights, means)
+
+    def cdf(self, values):
+        """
+        Return the approximate weight of values at or below each of values.
+        """
+        weights, means = self.positions()
+        return numpy.interp(values, means, weights)
+
+def chunks(result, columns, size=65536):
+    """
+    Yield an array of values for each column from `size` rows of the result
+    at a time.
+    """
+    rows = iter(result)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield [asSeries([row[column] for row in chunk]) for column in columns]
+
+class Histogram(object):
+    """
+    The counts of values falling in each of a number of equal-width bins,
+    along with the counts of values below and above them.
+    """
+    __slots__ = ('edges', 'counts', 'below', 'above', 'estimated')
+
+    def __init__(self, edges, counts, below, above, estimated=False):
+        self.edges = edges
+        self.counts = counts
+        self.below = below
+        self.above = above
+        self.estimated = estimated
+
+def histogram(result, axis, weight=None, bins=20, minimum=None,
+              maximum=None, quantile=0.99):
+    """
+    Bin the values of the axis column, each counted by the weight column if
+    given, in a single pass over the result. With both a minimum and
+    maximum values are counted exactly into fixed bins; otherwise a
+    quantile sketch of the values chooses bounds from the `1 - quantile`
+    and `quantile` quantiles and the counts are estimated from it.
+    """
+    columns = [result.index(axis)]
+    if weight is not None:
+        columns.append(result.index(weight))
+
+    if minimum is not None and maximum is not None:
+        edges = numpy.linspace(float(minimum), float(maximum), bins + 1)
+        counts = numpy.zeros(bins)
+        below = above = 0.0
+        for chunk in chunks(result, columns):
+            values = chunk[0]
+            weights = numpy.nan_to_num(chunk[1]) if weight is not None \
+                else numpy.ones_like(values)
+            present = ~numpy.isnan(values)
+            values, weights = values[present], weights[present]
+            counts += numpy.histogram(values, edges, weights=weights)[0]
+            below += weights[values < edges[0]].sum()
+            above += weights[values > edges[-1]].sum()
+        return Histogram(edges, counts, below, above)
+
+    sketch = QuantileSketch()
+    for chunk in chunks(result, columns):
+        sketch.add(*chunk)
+    if not sketch.count:
+        return Histogram(numpy.zeros(bins + 1), numpy.zeros(bins), 0.0, 0.0)
+    low = sketch.quantile(1 - quantile) if minimum is None else float(minimum)
+    high = sketch.quantile(quantile) if maximum is None else float(maximum)
+    edges = numpy.linspace(low, max(high, low), bins + 1)
+    cumulative = sketch.cdf(edges)
+    return Histogram(edges, numpy.diff(cumulative), cumulative[0],
+                     sketch.count - cumulative[-1], estimated=True)
+
+def bar(value, scale):
+    """
+    Draw value as a horizontal bar of scale characters per unit.
+    """
+    eighths = int(round(value * scale * 8))
+    whole, part = divmod(eighths, 8)
+    return bar_chars[-1] * whole + (bar_chars[part] if part else u"")
@@ -0,0 +1,126 @@
+import csv
+import json
+import uuid
+import decimal
+import datetime
+import itertools
+
+from mark.result import ColumnResult
+from mark.errors import CLIError
+
+def jsonValue(value):
+    """
+    Convert values the json module can't encode.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (uuid.UUID, buffer, memoryview)):
+        return str(value)
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+def batches(result, size):
+    """
+    Yield lists of up to size rows from the result as they are read.
+    """
+    rows = iter(result)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def writeJSONLines(result, out, batch_size=1000):
+    """
+    Write each row as a JSON object of its columns on its own line.
+    """
+    # non-ASCII characters are escaped so encoded values are always ASCII
+    encode = json.JSONEncoder(default=jsonValue).encode
+    # the text preceding each value of a row
+    prefixes = [("{" if i == 0 else ", ") + encode(name) + ": "
+                for i, name in enumerate(result.names)]
+    for batch in batches(result, batch_size):
+        lines = ["".join([prefix + encode(value)
+                          for prefix, value in zip(prefixes, row)]) + "}\n"
+                 for row in batch]
+        out.write("".join(lines))
+
+def csvValue(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+def writeCSV(result, out, batch_size=1000):
+    """
+    Write the column names and then each row as CSV.
+    """
+    writer = csv.writer(out)
+    writer.writerow([csvValue(name) for name in result.names])
+    for batch in batches(result, batch_size):
+        writer.writerows([[csvValue(value) for value in row] for row in batch])
+
+def writeArrow(result, out, batch_size=1000):
+    """
+    Write the rows as an Arrow IPC stream of record batches. Each column is
+    typed by the first batch in which it has a value, so batches are held
+    back until every column has had one.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        msg = "Arrow output requires the pyarrow module."
+        raise CLIError(msg)
+
+    if isinstance(result, ColumnResult):
+        # bulk fetched results are already held by column
+        columns = result.columns
+        slices = ([column[start:start + batch_size] for column in columns]
+                  for start in xrange(0, len(result), batch_size))
+    else:
+        slices = (zip(*batch) for batch in batches(result, batch_size))
+
+    def write(writer, schema, columns):
+        arrays = [pyarrow.array(column, type=field.type)
+                  for column, field in zip(columns, schema)]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays,
+                                                           result.names))
+
+    types = [None] * len(result.names)
+    pending, writer, schema = [], None, None
+    for columns in slices:
+        if writer is not None:
+            write(writer, schema, columns)
+            continue
+        pending.append(columns)
+        for i, column in enumerate(columns):
+            if types[i] is None:
+                inferred = pyarrow.array(column).type
+                if not pyarrow.types.is_null(inferred):
+                    types[i] = inferred
+        if None in types:
+            continue
+        schema = pyarrow.schema(zip(result.names, types))
+        writer = pyarrow.RecordBatchStreamWriter(out, schema)
+        for held in pending:
+            write(writer, schema, held)
+        pending = []
+
+    if writer is None:
+        # columns without a single value can only be typed null
+        schema = pyarrow.schema([(name, kind or pyarrow.null())
+                                 for name, kind in zip(result.names, types)])
+        writer = pyarrow.RecordBatchStreamWriter(out, schema)
+        for held in pending:
+            write(writer, schema, held)
+    writer.close()
+
+encoders = {
+    'jsonl': writeJSONLines,
+    'csv': writeCSV,
+    'arrow': writeArrow,
+}
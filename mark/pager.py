@@ -0,0 +1,56 @@
+import os
+import sys
+import errno
+import subprocess
+from contextlib import contextmanager
+
+class PagerPipe(object):
+    """
+    A file piping what is written to it through $PAGER, or less. The pager
+    is only started by the first write, so that nothing else needs to share
+    the terminal with it while output is still being prepared.
+    """
+
+    def __init__(self):
+        self.process = None
+
+    def write(self, data):
+        if self.process is None:
+            env = dict(os.environ)
+            env.setdefault('LESS', 'FRSX')
+            command = os.environ.get('PAGER', 'less')
+            self.process = subprocess.Popen(command, shell=True, env=env,
+                                            stdin=subprocess.PIPE)
+        self.process.stdin.write(data)
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.process.wait()
+
+@contextmanager
+def pager(out=sys.stdout, enabled=True):
+    """
+    Yield a file to write output to. When out is a terminal the output is
+    piped through $PAGER, or less, which exits at once if it fits on one
+    screen. Quitting the pager early stops the output quietly.
+    """
+    if not enabled or not out.isatty():
+        yield out
+        return
+
+    pipe = PagerPipe()
+    try:
+        yield pipe
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+    finally:
+        pipe.close()
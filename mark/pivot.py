@@ -0,0 +1,103 @@
+import re
+from array import array
+
+import numpy
+
+ansi_escape = re.compile(r'(\x1b[^m]*m)|\n|\t')
+
+class Interner(object):
+    """
+    Assign each distinct value a dense integer index, cleaning each distinct
+    value only once.
+    """
+
+    def __init__(self, clean):
+        self.clean = clean
+        self.indices = {}
+        self.names = []
+        self.seen = {}
+
+    def index(self, value):
+        if value in self.seen:
+            return self.seen[value]
+        name = self.clean(value)
+        if name not in self.indices:
+            self.indices[name] = len(self.names)
+            self.names.append(name)
+        self.seen[value] = self.indices[name]
+        return self.seen[value]
+
+def cleanLabel(value):
+    return ansi_escape.sub('', unicode(value))
+
+def labelKey(value):
+    """
+    Return the value labels are sorted by. Strings are stripped of ANSI
+    escapes, while other values keep their type so numbers and times sort
+    by value rather than as text.
+    """
+    if isinstance(value, basestring):
+        return cleanLabel(value)
+    return value
+
+class Pivot(object):
+    """
+    A dense partitions x keys matrix of values. Keys are sorted and cells
+    with no value are zero.
+    """
+    __slots__ = ('partitions', 'keys', 'matrix')
+
+    def __init__(self, partitions, keys, matrix):
+        self.partitions = partitions
+        self.keys = keys
+        self.matrix = matrix
+
+    def totals(self):
+        return numpy.nansum(self.matrix, axis=1)
+
+    def peaks(self):
+        return numpy.nanmax(self.matrix, axis=1)
+
+    def top(self, limit):
+        """
+        Return the row indices of the `limit` partitions with the largest
+        totals, ordered by ascending total.
+        """
+        totals = self.totals()
+        if limit and limit < len(totals):
+            chosen = numpy.argpartition(totals, -limit)[-limit:]
+        else:
+            chosen = numpy.arange(len(totals))
+        return chosen[numpy.argsort(totals[chosen], kind='mergesort')]
+
+def pivot(result, partition, label, axis):
+    """
+    Pivot a Result into a Pivot of the axis value for each partition and
+    label in a single pass. Keys are sorted by their values and, like
+    partitions, stripped of ANSI escapes.
+    """
+    partition, label, axis = [result.index(name)
+                              for name in (partition, label, axis)]
+    partitions = Interner(cleanLabel)
+    keys = Interner(labelKey)
+    partition_indices, key_indices = array('l'), array('l')
+    values = array('d')
+    for row in result:
+        partition_indices.append(partitions.index(row[partition]))
+        key_indices.append(keys.index(row[label]))
+        value = row[axis]
+        values.append(float('nan') if value is None else value)
+    if not values:
+        return Pivot([], [], numpy.zeros((0, 0)))
+
+    # map key indices to their position in the sorted keys
+    order = sorted(range(len(keys.names)), key=keys.names.__getitem__)
+    ranks = numpy.empty(len(order), dtype=int)
+    ranks[order] = numpy.arange(len(order))
+
+    matrix = numpy.zeros((len(partitions.names), len(keys.names)))
+    matrix[numpy.frombuffer(partition_indices, dtype='l'),
+           ranks[numpy.frombuffer(key_indices, dtype='l')]] = \
+        numpy.frombuffer(values, dtype='d')
+    sorted_keys = [cleanLabel(keys.names[i]) for i in order]
+    return Pivot(partitions.names, sorted_keys, matrix)
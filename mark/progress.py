@@ -0,0 +1,112 @@
+import sys
+import time
+import threading
+
+from mark.result import Result, ColumnResult
+
+class Progress(object):
+    """
+    A status line on the terminal showing how long a query has been running
+    and how many rows it has fetched. Nothing is drawn unless the stream is
+    a terminal, and the line is redrawn at most every `interval` seconds.
+    """
+
+    def __init__(self, term, label, stream=sys.stderr, interval=0.1):
+        self.term = term
+        self.label = label
+        self.stream = stream
+        self.interval = interval
+        self.enabled = stream.isatty()
+        self.started = time.time()
+        self.drawn = None
+        self.rows = 0
+
+    def text(self):
+        elapsed = time.time() - self.started
+        text = u"{} running for {:.1f}s".format(self.label, elapsed)
+        if self.rows:
+            text += u", {:,} rows fetched".format(self.rows)
+        return text
+
+    def draw(self, force=False):
+        if not self.enabled:
+            return
+        now = time.time()
+        if not force and self.drawn and now - self.drawn < self.interval:
+            return
+        self.drawn = now
+        line = self.term.dim(self.text()).encode('utf8', 'replace')
+        self.stream.write("\r" + line + self.term.clear_eol)
+        self.stream.flush()
+
+    def clear(self):
+        if self.enabled and self.drawn:
+            self.stream.write("\r" + self.term.clear_eol)
+            self.stream.flush()
+            self.drawn = None
+
+    def count(self, rows):
+        for row in rows:
+            self.rows += 1
+            yield row
+            if not self.rows % 1000:
+                self.draw()
+        self.clear()
+
+    def track(self, result):
+        """
+        Return the Result counting its rows as they are read, if they are
+        still being fetched.
+        """
+        if not self.enabled or isinstance(result, ColumnResult) or \
+                isinstance(result.rows, (list, tuple)):
+            return result
+        return Result(result.names, self.count(result))
+
+def cancellable(work, cancel, timeout=None, progress=None, interval=0.1):
+    """
+    Call work on a background thread so that waiting for it can be
+    interrupted, drawing the progress line while it runs. cancel is called
+    once work has run for timeout seconds, or on Ctrl-C, after which work is
+    still waited for so its statements end cleanly; a second Ctrl-C stops
+    waiting. Return the result of work or raise its exception.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = work()
+        except BaseException:
+            outcome['error'] = sys.exc_info()
+
+    thread = threading.Thread(target=run)
+    # an abandoned statement mustn't keep the process alive
+    thread.daemon = True
+    thread.start()
+    deadline = timeout and time.time() + float(timeout)
+    cancelled = interrupted = False
+    try:
+        while thread.is_alive():
+            try:
+                # joining with a timeout leaves Ctrl-C deliverable
+                thread.join(interval)
+            except KeyboardInterrupt:
+                if interrupted:
+                    raise
+                interrupted = True
+                cancel()
+                continue
+            if progress is not None:
+                progress.draw()
+            if deadline and not cancelled and time.time() > deadline:
+                cancelled = True
+                cancel()
+    finally:
+        if progress is not None:
+            progress.clear()
+    if interrupted:
+        raise KeyboardInterrupt
+    if 'error' in outcome:
+        kind, error, traceback = outcome['error']
+        raise kind, error, traceback
+    return outcome['result']
@@ -0,0 +1,91 @@
+from mark.errors import QueryError
+
+# SQL aggregates matching the aggregates used to downsample series
+aggregates = {
+    'min': 'min({value})',
+    'max': 'max({value})',
+    'mean': 'avg({value})',
+    'sum': 'sum({value})',
+    'last': '(array_agg({value} order by {label} desc))[1]',
+}
+
+def quoteIdentifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+def timeBucket(label, buckets, unit=None):
+    """
+    Return an expression truncating the label to the named date_trunc unit,
+    or to one of `buckets` equal intervals spanning all labels.
+    """
+    if unit:
+        return "date_trunc('{}', results.{})".format(unit, label)
+    epoch = "extract(epoch from results.{})".format(label)
+    size = ("greatest((extract(epoch from bounds.high) - "
+            "extract(epoch from bounds.low)) / {}, 1)").format(buckets)
+    return "to_timestamp(floor({} / {}) * {})".format(epoch, size, size)
+
+def numericBucket(label, buckets):
+    """
+    Return an expression for the lower bound of the label's bucket among
+    `buckets` equal-width buckets spanning all labels.
+    """
+    size = "(bounds.high - bounds.low) / {}.0".format(buckets)
+    bucket = ("least(width_bucket(results.{}, bounds.low, bounds.high, {}), {})"
+              .format(label, buckets, buckets))
+    return ("case when bounds.high = bounds.low then bounds.low "
+            "else bounds.low + ({} - 1) * {} end").format(bucket, size)
+
+def pushdownQuery(sql, graph):
+    """
+    Wrap the sql in an outer query which aggregates the graph's axis into
+    about as many label buckets as the graph can draw, so the database
+    returns one row per bucket rather than every row.
+    """
+    if graph.aggregate not in aggregates:
+        msg = "Aggregate `{}` can't be pushed down to the database."
+        raise QueryError(msg.format(graph.aggregate))
+
+    label = quoteIdentifier(graph.label)
+    axis = quoteIdentifier(graph.axis)
+    buckets = int(graph.seriesWidth())
+
+    if graph.pushdown == 'time':
+        bucket = timeBucket(label, buckets, graph.unit)
+    elif graph.pushdown == 'numeric':
+        bucket = numericBucket(label, buckets)
+    else:
+        msg = "Pushdown must be `time` or `numeric`, not `{}`."
+        raise QueryError(msg.format(graph.pushdown))
+
+    aggregate = aggregates[graph.aggregate].format(
+        value="results." + axis, label="results." + label)
+    columns = ["{} as {}".format(bucket, label),
+               "{} as {}".format(aggregate, axis)]
+    groups = "1"
+    if graph.partition:
+        columns.insert(0, "results." + quoteIdentifier(graph.partition))
+        groups = "1, 2"
+
+    return ("with results as ({}), "
+            "bounds as (select min({}) as low, max({}) as high from results) "
+            "select {} from results, bounds group by {} order by {}").format(
+                sql.strip().rstrip(';'), label, label, ", ".join(columns),
+                groups, groups)
+
+def watermarkQuery(sql, column, position):
+    """
+    Wrap the sql in an outer query returning only the rows whose watermark
+    column is at or past the value of bind parameter `position`, ordered by
+    the watermark.
+    """
+    column = quoteIdentifier(column)
+    return ("select * from ({}) as results where results.{} >= ${} "
+            "order by results.{}").format(sql.strip().rstrip(';'), column,
+                                          position, column)
+
+def limitQuery(sql, limit):
+    """
+    Wrap the sql in an outer query returning at most limit rows.
+    """
+    return "select * from ({}) as results limit {:d}".format(
+        sql.strip().rstrip(';'), limit)
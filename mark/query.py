@@ -1,29 +1,68 @@
+import itertools
 from collections import defaultdict
 
-import sqlparse
-
 from blessings import Terminal
 t = Terminal()
 
-from mark.template import callTemplate, makeEnvironment, parseVariables
+from mark.template import callTemplate, bindTemplate, makeEnvironment, makeBytecodeCache, parseVariables, CompiledTemplate
 from mark.errors import QueryError
-from mark.utils import pad
+from mark.utils import pad, LazyModule, LRUCache
+
+# only needed once a query is run, not when listing queries
+sqlparse = LazyModule('sqlparse')
+
+# compiled query templates and the columns selected by rendered queries,
+# which are reused whenever the same query is called again
+compiled_queries = LRUCache(256)
+query_columns = LRUCache(1024)
 
 # template helpers
-def createQueryEnvironment():
+def createQueryEnvironment(cache=True):
     """
-    Create a Jinja2 Environment suitable for rendering query templates.
+    Create a Jinja2 Environment suitable for rendering query templates,
+    compiling them through the bytecode cache unless cache is False.
     """
     return makeEnvironment(strict=True,
+                           bytecode_cache=makeBytecodeCache() if cache else None,
                            variable_start_string="[",
                            variable_end_string="]")
 
+_environment = None
+
+def queryEnvironment():
+    """
+    Return the Environment shared by every query template.
+    """
+    global _environment
+    if _environment is None:
+        _environment = createQueryEnvironment()
+    return _environment
+
+def useBytecodeCache(enabled):
+    """
+    Choose whether query templates are compiled through the bytecode cache,
+    replacing the shared Environment.
+    """
+    global _environment
+    _environment = createQueryEnvironment(cache=enabled)
+    compiled_queries.clear()
+
+def compileQuery(query):
+    """
+    Return the CompiledTemplate for a query template, which is only parsed
+    and compiled the first time it is seen.
+    """
+    compiled = compiled_queries.get(query)
+    if compiled is None:
+        compiled = CompiledTemplate(queryEnvironment(), query)
+        compiled_queries.set(query, compiled)
+    return compiled
+
 def extractQueryParams(query):
     """
     Extract Jijna2 variables from a query template.
     """
-    env = createQueryEnvironment()
-    return parseVariables(env, query)
+    return parseVariables(queryEnvironment(), query)
 
 def queryParametersFromMapping(mapping):
     """
@@ -36,7 +75,7 @@ def queryParametersFromMapping(mapping):
     {'query_a': sql_query} => [('query_a', var1, var2, var3)]
     """
     rows = []
-    env = createQueryEnvironment()
+    env = queryEnvironment()
     for key in sorted(mapping.keys(), key=len):
         spec = mapping[key]
         columns = parseVariables(env, spec['query'])
@@ -61,16 +100,14 @@ def indexedLengthMaximums(rows):
                 lengths[idx] = length
     return lengths
 
-def printQueryTable(filename, markfile):
+def printQueryTable(filename, queries):
     """
-    Print each query in the markfile by name and
-    arguments. Laboriously, Format the output into a table
-    so that arguments take up the same width for
-    readability.
+    Print each query by name and arguments, as returned by
+    queryParametersFromMapping. Laboriously, Format the
+    output into a table so that arguments take up the same
+    width for readability.
     """
 
-    # get a list of each query template and associated variables
-    queries = queryParametersFromMapping(markfile)
     # sort the queries by how many parameters it takes
     queries = sorted(queries, key=len)
     # get an index of the maximum lengths of query names and variables
@@ -91,6 +128,25 @@ def printQueryTable(filename, markfile):
 
 # sql helpers
 
+def selectList(sql):
+    """
+    Return the sql up to the FROM clause of its outer query, which is as
+    much as is needed to find the selected columns. Only that much of the
+    sql is tokenized.
+    """
+    Punctuation = sqlparse.tokens.Punctuation
+    depth, values = 0, []
+    for ttype, value in sqlparse.lexer.tokenize(sql):
+        if ttype in Punctuation and value == '(':
+            depth += 1
+        elif ttype in Punctuation and value == ')':
+            depth -= 1
+        elif not depth and ttype in sqlparse.tokens.Keyword and \
+                value.upper() == 'FROM':
+            break
+        values.append(value)
+    return u"".join(values)
+
 def parseQueryTokens(sql):
     """
     Parse an SQL query into an AST of tokens.
@@ -114,18 +170,33 @@ def assertSelectQuery(query_tokens):
 
 def assertQueryColumns(query_tokens):
     """
-    Assert provided AST tokens begin with column names to select.
+    Assert provided AST tokens begin with column names to select, or a
+    single column.
     """
-    ident_token = query_tokens[1]
+    columns = (sqlparse.sql.IdentifierList, sqlparse.sql.Identifier,
+               sqlparse.sql.Function)
+    ident_token = query_tokens[1] if len(query_tokens) > 1 else None
 
-    if not isinstance(ident_token, sqlparse.sql.IdentifierList):
+    if ident_token is None or not (isinstance(ident_token, columns) or
+                                   ident_token.ttype == sqlparse.tokens.Keyword):
         msg = "Query must begin with column names to select."
         raise QueryError(msg)
 
 
 def parseQueryColumns(sql):
     """
-    Extract the column identifiers selected in the provided query.
+    Extract the column identifiers selected in the provided query. Only the
+    select list is parsed, and only the first time the query is seen.
+    """
+    identifiers = query_columns.get(sql)
+    if identifiers is None:
+        identifiers = parseSelectList(selectList(sql))
+        query_columns.set(sql, identifiers)
+    return list(identifiers)
+
+def parseSelectList(sql):
+    """
+    Extract the column identifiers from the select list of a query.
     """
     query_tokens = parseQueryTokens(sql)
     assertSelectQuery(query_tokens)
@@ -133,6 +204,9 @@ def parseQueryColumns(sql):
 
     identifiers = []
     ident_token = query_tokens[1]
+    if not isinstance(ident_token, sqlparse.sql.IdentifierList):
+        # a single selected column
+        ident_token = sqlparse.sql.TokenList([ident_token])
     for token in ident_token.tokens:
         if isinstance(token, (sqlparse.sql.Identifier,
                               sqlparse.sql.Function)):
@@ -147,5 +221,35 @@ def parseQueryColumns(sql):
     return identifiers
 
 def callQuery(query, args, kwargs):
-    env = createQueryEnvironment()
-    return callTemplate(env, query, args, kwargs)
+    return callTemplate(compileQuery(query), args, kwargs)
+
+def bindQuery(query, args, kwargs, sweep=None):
+    """
+    Render the query template with its parameters as bind parameters rather
+    than text. Swept parameters refer to the columns of the sweep instead.
+    Return the sql and the values of the bind parameters.
+    """
+    bound = dict((name, 'sweep."{}"'.format(name)) for name in sweep or ())
+    return bindTemplate(compileQuery(query), args, kwargs, bound)
+
+def sweepQuery(sql, params, sweep):
+    """
+    Wrap sql bound with bindQuery so it runs once for every combination of
+    the swept parameter values in a single statement. Each swept parameter
+    becomes a leading text column of the results. Return the wrapped sql
+    and its bind parameter values.
+
+    Example:
+    sweepQuery(sql, [], {'host': ['a', 'b']}) runs sql with host a and b
+    """
+    names = sweep.keys()
+    combinations = list(itertools.product(*sweep.values()))
+    columns = [list(values) for values in zip(*combinations)]
+    arrays = ["${}::text[]".format(len(params) + i + 1)
+              for i in range(len(names))]
+    quoted = ['"{}"'.format(name) for name in names]
+    wrapped = ("select {}, results.* from unnest({}) as sweep({}) "
+               "cross join lateral ({}) as results").format(
+                   ", ".join("sweep." + q for q in quoted), ", ".join(arrays),
+                   ", ".join(quoted), sql.strip().rstrip(';'))
+    return wrapped, list(params) + columns
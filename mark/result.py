@@ -0,0 +1,82 @@
+import itertools
+
+from mark.errors import QueryError
+
+def columnNames(description):
+    """
+    Return the column names from a cursor description.
+    """
+    return [column[0] for column in description]
+
+class Result(object):
+    """
+    The rows returned by a query, each a tuple of values, along with the
+    column names which are held once for all rows. Rows may be a list or a
+    stream which can only be iterated once.
+    """
+    __slots__ = ('names', 'rows')
+
+    def __init__(self, names, rows):
+        self.names = list(names)
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def index(self, name):
+        """
+        Return the position of the named column in each row.
+        """
+        if name not in self.names:
+            msg = "Column `{}` not in query results: {}"
+            raise QueryError(msg.format(name, ", ".join(self.names)))
+        return self.names.index(name)
+
+    def peek(self):
+        """
+        Return the first row, or None if there are none, without consuming
+        it from a stream.
+        """
+        rows = iter(self.rows)
+        first = next(rows, None)
+        if isinstance(self.rows, (list, tuple)):
+            return first
+        self.rows = rows if first is None else itertools.chain([first], rows)
+        return first
+
+    def materialize(self):
+        """
+        Return the result with its rows read into a list.
+        """
+        if isinstance(self.rows, list):
+            return self
+        return Result(self.names, list(self.rows))
+
+class ColumnResult(Result):
+    """
+    A Result held as a list of values per column, as decoded from bulk
+    fetches. Rows are zipped together as they are iterated.
+    """
+    __slots__ = ('columns',)
+
+    def __init__(self, names, columns):
+        Result.__init__(self, names, None)
+        self.columns = columns
+
+    def __iter__(self):
+        return itertools.izip(*self.columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def peek(self):
+        return next(iter(self), None)
+
+    def materialize(self):
+        return self
+
+    def column(self, name):
+        return self.columns[self.index(name)]
@@ -0,0 +1,102 @@
+import decimal
+
+from mark.result import Result
+from mark.utils import LazyModule
+
+sqlparse = LazyModule('sqlparse')
+
+# the percentages of their tables' pages queries are previewed with
+percentages = (0.1, 1, 10)
+
+# keywords which end the FROM clause
+clauses = ('WHERE', 'GROUP BY', 'HAVING', 'WINDOW', 'ORDER BY', 'LIMIT',
+           'OFFSET', 'FETCH', 'FOR')
+
+# aggregates whose values grow with the share of the table read
+scaling = ('count', 'sum')
+
+def sampleQuery(sql, percentage):
+    """
+    Return the sql reading only about percentage percent of its table's
+    pages with TABLESAMPLE SYSTEM, or None if it can't be sampled. Only
+    queries selecting from a single table, without joins, subqueries or
+    functions in their FROM clause, CTEs or set operations, are sampled.
+    """
+    Punctuation = sqlparse.tokens.Punctuation
+    tokens = list(sqlparse.parse(sql.strip().rstrip(';'))[0].flatten())
+    depth, start, end = 0, None, None
+    for i, token in enumerate(tokens):
+        if token.match(Punctuation, '('):
+            depth += 1
+        elif token.match(Punctuation, ')'):
+            depth -= 1
+        in_from = start is not None and end is None
+        if depth:
+            if in_from:
+                return None
+            continue
+        keyword = token.normalized if token.is_keyword else None
+        if token.ttype in sqlparse.tokens.Keyword.CTE or \
+                keyword in ('UNION', 'INTERSECT', 'EXCEPT'):
+            return None
+        if keyword == 'FROM':
+            start = i + 1
+        elif not in_from:
+            continue
+        elif keyword in clauses:
+            end = i
+        elif token.match(Punctuation, ',') or keyword and (
+                'JOIN' in keyword or keyword in ('LATERAL', 'TABLESAMPLE')):
+            return None
+    if start is None:
+        return None
+    end = len(tokens) if end is None else end
+    before = u"".join(token.value for token in tokens[:end]).rstrip()
+    after = u"".join(token.value for token in tokens[end:])
+    return u"{} tablesample system ({:g}) {}".format(
+        before, percentage, after).rstrip()
+
+def estimatedColumns(sql):
+    """
+    Return the names of the selected columns which count or sum rows, whose
+    values in a sample must be scaled up to estimate those of the table.
+    """
+    statement = sqlparse.parse(sql)[0]
+    selected = [token for token in statement.tokens
+                if isinstance(token, sqlparse.sql.IdentifierList)][:1]
+    names = []
+    for token in selected and selected[0].tokens:
+        function = token
+        if isinstance(token, sqlparse.sql.Identifier):
+            function = token.tokens[0]
+        if isinstance(function, sqlparse.sql.Function) and \
+                function.get_real_name().lower() in scaling:
+            names.append(token.get_name())
+    return names
+
+def scaleValue(value, factor):
+    if value is None:
+        return None
+    if isinstance(value, decimal.Decimal):
+        return value * decimal.Decimal(repr(factor))
+    if isinstance(value, (int, long)):
+        return int(round(value * factor))
+    return value * factor
+
+def scaleResult(result, names, percentage):
+    """
+    Return the Result of a query run on a percentage sample with the named
+    columns scaled up to estimates for the whole table.
+    """
+    positions = [result.index(name) for name in names
+                 if name in result.names]
+    if not positions:
+        return result
+    factor = 100.0 / percentage
+    rows = []
+    for row in result:
+        row = list(row)
+        for position in positions:
+            row[position] = scaleValue(row[position], factor)
+        rows.append(tuple(row))
+    return Result(result.names, rows)
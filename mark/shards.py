@@ -0,0 +1,195 @@
+import time
+import heapq
+import operator
+import itertools
+import threading
+from collections import OrderedDict
+
+from mark.result import Result
+from mark.utils import LazyModule
+
+sqlparse = LazyModule('sqlparse')
+
+# how values of the same group from different shards are combined
+aggregators = {
+    'sum': operator.add,
+    'min': min,
+    'max': max,
+}
+
+class ShardSet(object):
+    """
+    Connections to a set of databases sharing a schema, each labelled, on
+    which the same query is run concurrently. Shards which haven't answered
+    within `timeout` seconds are left out of the results and have their
+    statements cancelled.
+    """
+
+    def __init__(self, shards, config, timeout=None):
+        self.shards = shards
+        self.config = config
+        self.timeout = timeout
+
+    def run(self, fetch):
+        """
+        Call fetch with the connection to each shard concurrently. Return
+        the label and result of each shard which answered in time, along
+        with a message for each shard which failed or timed out.
+        """
+        answers = [None] * len(self.shards)
+
+        def work(i, db):
+            try:
+                answers[i] = (fetch(db), None)
+            except Exception as e:
+                answers[i] = (None, e)
+
+        threads = []
+        for i, (label, db) in enumerate(self.shards):
+            thread = threading.Thread(target=work, args=(i, db))
+            # a shard still running past the timeout is abandoned
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        deadline = self.timeout and time.time() + self.timeout
+        for thread in threads:
+            thread.join(deadline and max(deadline - time.time(), 0))
+
+        results, failures = [], []
+        for (label, db), answer in zip(self.shards, list(answers)):
+            if answer is None:
+                # stop the abandoned statements running on the server
+                db.cancel()
+                msg = "Shard `{}` timed out after {} seconds."
+                failures.append(msg.format(label, self.timeout))
+            elif answer[1] is not None:
+                msg = "Shard `{}` failed: {}"
+                failures.append(msg.format(label, answer[1]))
+            else:
+                results.append((label, answer[0]))
+        return results, failures
+
+    def cancel(self):
+        """
+        Cancel the statements running on every shard.
+        """
+        for label, db in self.shards:
+            db.cancel()
+
+def orderBy(sql, names):
+    """
+    Return the position in the selected columns of each term of the outer
+    ORDER BY clause of the sql, and whether it is descending, along with
+    the outer LIMIT. Terms which aren't selected columns give no order.
+    """
+    statement = sqlparse.parse(sql.strip().rstrip(';'))[0]
+    tokens = [token for token in statement.tokens if not token.is_whitespace]
+    start, end, limit = None, len(tokens), None
+    for i, token in enumerate(tokens):
+        keyword = token.normalized if token.is_keyword else None
+        if keyword == 'ORDER BY':
+            start = i + 1
+        elif keyword in ('LIMIT', 'OFFSET', 'FETCH', 'FOR'):
+            # the order clause runs until the next clause
+            if start is not None:
+                end = min(end, i)
+            if keyword == 'LIMIT' and tokens[i + 1:i + 2] and \
+                    tokens[i + 1].value.isdigit():
+                limit = int(tokens[i + 1].value)
+    if start is None:
+        return None, limit
+    order = u" ".join(token.value for token in tokens[start:end])
+
+    terms = []
+    for term in order.split(','):
+        words = term.split()
+        name = words[0].split('.')[-1].strip('"')
+        if name.isdigit() and 0 < int(name) <= len(names):
+            position = int(name) - 1
+        elif name in names:
+            position = names.index(name)
+        else:
+            return None, limit
+        terms.append((position, 'desc' in [w.lower() for w in words[1:]]))
+    return terms, limit
+
+class Descending(object):
+    """
+    Wraps a value so that it sorts in reverse.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def labelled(label, result, column):
+    """
+    Yield the rows of the result, preceded by the label of their shard if
+    there is a shard column.
+    """
+    if column is None:
+        return iter(result)
+    return ((label,) + tuple(row) for row in result)
+
+def concatenate(results, column=None):
+    """
+    Return a Result of the rows of each shard in turn, with the shard's
+    label in the first column if a column name is given.
+    """
+    names = results[0][1].names
+    rows = itertools.chain.from_iterable(
+        labelled(label, result, column) for label, result in results)
+    return Result(([column] if column else []) + names, rows)
+
+def mergeOrdered(results, order, limit=None, column=None):
+    """
+    Return a Result of the rows of every shard merged in order, given the
+    rows of each shard are already sorted by the order terms from orderBy.
+    Rows are merged as they are read from the shards.
+    """
+    names = results[0][1].names
+    offset = 1 if column else 0
+
+    def decorate(i, label, result):
+        for row in labelled(label, result, column):
+            key = tuple(Descending(row[offset + position]) if descending
+                        else row[offset + position]
+                        for position, descending in order)
+            # the shard index breaks ties so rows are never compared
+            yield key, i, row
+
+    streams = [decorate(i, label, result)
+               for i, (label, result) in enumerate(results)]
+    rows = (row for key, i, row in heapq.merge(*streams))
+    if limit is not None:
+        rows = itertools.islice(rows, limit)
+    return Result(([column] if column else []) + names, rows)
+
+def reaggregate(result, axis, how='sum'):
+    """
+    Return a Result with a single row for each group of rows which differ
+    only in their axis value, combining those values with the named
+    aggregator. Groups keep the order they are first seen in.
+    """
+    index = result.index(axis)
+    combine = aggregators[how]
+    groups = OrderedDict()
+    for row in result:
+        key = tuple(row[:index]) + tuple(row[index + 1:])
+        value = row[index]
+        previous = groups.get(key)
+        if previous is not None and value is not None:
+            value = combine(previous, value)
+        elif value is None:
+            value = previous
+        groups[key] = value
+    rows = [key[:index] + (value,) + key[index:]
+            for key, value in groups.iteritems()]
+    return Result(result.names, rows)
@@ -1,9 +1,102 @@
 # -*- coding: utf-8 -*-
 
+import warnings
+from array import array
+
+import numpy
+
+from mark.terminal import terminal
+
 spark_chars = u"▁▂▃▄▅▆▇█"
+spark_array = numpy.array(list(spark_chars + u" "))
+
+def terminalWidth(default=80):
+    """
+    Return the width of the terminal being rendered for or default if there
+    is none.
+    """
+    return terminal.width or default
+
+def asSeries(series):
+    """
+    Convert <series> to an array of floats with NULLs as NaN.
+    """
+    if not isinstance(series, (list, tuple, array, numpy.ndarray)):
+        series = list(series)
+    return numpy.asarray(series, dtype=float)
+
+def downsample(series, width, aggregate='max'):
+    """
+    Reduce the array <series> to <width> buckets of consecutive values using
+    the named aggregate: one of min, max, mean, sum or last. NaN values are
+    ignored unless every value in a bucket is NaN. Two dimensional arrays
+    are reduced along each row.
+
+    Example:
+    >>> downsample(numpy.array([1., 5., 2., 2., 7., 3.]), 3).tolist()
+    [5.0, 2.0, 7.0]
+    """
+    length = series.shape[-1]
+    if length <= width:
+        return series
+    starts = (numpy.arange(width) * length) // width
+    if aggregate == 'last':
+        ends = numpy.append(starts[1:], length)
+        return series[..., ends - 1]
+    if aggregate == 'max':
+        return numpy.fmax.reduceat(series, starts, axis=-1)
+    if aggregate == 'min':
+        return numpy.fmin.reduceat(series, starts, axis=-1)
+    if aggregate == 'sum':
+        return numpy.add.reduceat(numpy.nan_to_num(series), starts, axis=-1)
+    if aggregate == 'mean':
+        present = ~numpy.isnan(series)
+        totals = numpy.add.reduceat(numpy.where(present, series, 0.0),
+                                    starts, axis=-1)
+        counts = numpy.add.reduceat(present.astype(float), starts, axis=-1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+    raise ValueError("Unknown aggregate `{}`".format(aggregate))
+
+def sparkifyRows(matrix, minimum=None, maximum=None, width=None,
+                 aggregate='max'):
+    u"""Converts each row of the 2d array <matrix> to a sparkline string, each
+    scaled to its own range unless <minimum> or <maximum> are given. If
+    <width> is given, rows longer than it are downsampled to <width>
+    characters. NaN values are drawn as blanks.
+
+    Example:
+    >>> [len(s) for s in sparkifyRows(numpy.zeros((3, 50)), width=20)]
+    [20, 20, 20]
+    """
+    matrix = numpy.asarray(matrix, dtype=float)
+    if width:
+        matrix = downsample(matrix, width, aggregate)
+    missing = numpy.isnan(matrix)
+    with numpy.errstate(invalid='ignore'), warnings.catch_warnings():
+        # rows of only NaN have no range and are drawn entirely blank
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lows = numpy.nanmin(matrix, axis=1) if minimum is None \
+            else numpy.repeat(float(minimum), len(matrix))
+        highs = numpy.nanmax(matrix, axis=1) if maximum is None \
+            else numpy.repeat(float(maximum), len(matrix))
+    data_range = (highs - lows)[:, numpy.newaxis]
+    # Graph a baseline for rows where every input value is equal.
+    flat = ~(data_range > 0.0)
+    coefficient = (len(spark_chars) - 1.0) / numpy.where(flat, 1.0, data_range)
+    with numpy.errstate(invalid='ignore'):
+        scaled = numpy.floor((matrix - lows[:, numpy.newaxis]) * coefficient
+                             + 0.5)
+    scaled = numpy.clip(numpy.nan_to_num(scaled), 0, len(spark_chars) - 1)
+    indices = numpy.where(flat, 0, scaled).astype(int)
+    # the final character is a blank for missing values
+    indices[missing] = len(spark_chars)
+    return [u''.join(row) for row in spark_array[indices]]
 
-def sparkify(series, minimum=None, maximum=None):
-    u"""Converts <series> to a sparkline string.
+def sparkify(series, minimum=None, maximum=None, width=None, aggregate='max'):
+    u"""Converts <series> to a sparkline string. If <width> is given, series
+    longer than it are downsampled to <width> characters. NULL and NaN
+    values are drawn as blanks.
 
     Example:
     >>> sparkify([ 0.5, 1.2, 3.5, 7.3, 8.0, 12.5, 13.2, 15.0, 14.2, 11.8, 6.1,
@@ -14,16 +107,6 @@ def sparkify(series, minimum=None, maximum=None):
     Raises ValueError if input data cannot be converted to float.
     Raises TypeError if series is not an iterable.
     """
-    series = [ float(i) for i in series ]
-    minimum = minimum or min(series)
-    maximum = maximum or max(series)
-    data_range = maximum - minimum
-    if data_range == 0.0:
-        # Graph a baseline if every input value is equal.
-        return u''.join([ spark_chars[0] for i in series ])
-    coefficient = (len(spark_chars) - 1.0) / data_range
-    return u''.join([
-        spark_chars[
-            int(round((x - minimum) * coefficient))
-        ] for x in series
-    ])
+    series = asSeries(series)
+    return sparkifyRows(series[numpy.newaxis, :], minimum, maximum,
+                        width=width, aggregate=aggregate)[0]
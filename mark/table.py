@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+from numbers import Number
+
+ellipsis = u"…"
+
+# the start, column separator and end of each line of a format, and the
+# same for the rule beneath the headers which is drawn with its fill
+formats = {
+    'orgtbl': ((u"| ", u" | ", u" |"), (u"|-", u"-+-", u"-|", u"-")),
+    'simple': ((u"", u"  ", u""), (u"", u"  ", u"", u"-")),
+    'plain': ((u"", u"  ", u""), None),
+}
+
+# characters which would break a row across lines or misalign it
+line_breaks = dict((ord(c), u" ") for c in u"\r\n\t")
+
+def cellText(value):
+    """
+    Return the value as a single line of unicode text.
+    """
+    if value is None:
+        return u""
+    if isinstance(value, str):
+        value = value.decode('utf8', 'replace')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    if u"\n" in value or u"\r" in value or u"\t" in value:
+        return value.translate(line_breaks)
+    return value
+
+def truncate(text, width):
+    """
+    Shorten text longer than width, ending it with an ellipsis.
+    """
+    if len(text) <= width:
+        return text
+    return text[:width - 1] + ellipsis
+
+def isNumeric(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+class StreamingTable(object):
+    """
+    Renders a result as a table a line at a time, so rows are written as
+    they are fetched and never held in memory together. Column widths are
+    fixed from the first `sample` rows, up to `column_width` characters,
+    and longer values are truncated with an ellipsis.
+    """
+
+    def __init__(self, tablefmt='simple', sample=100, column_width=40):
+        self.line, self.rule = formats[tablefmt]
+        self.sample = sample
+        self.column_width = column_width
+
+    def measure(self, headers, sample):
+        """
+        Return the width of each column, and whether it holds numbers, from
+        the headers and a sample of rows.
+        """
+        widths = [len(header) for header in headers]
+        numeric = [True] * len(headers)
+        for row in sample:
+            for i, value in enumerate(row):
+                widths[i] = max(widths[i], len(cellText(value)))
+                if value is not None and not isNumeric(value):
+                    numeric[i] = False
+        widths = [max(min(width, self.column_width), 1) for width in widths]
+        return widths, numeric
+
+    def template(self, widths, numeric):
+        """
+        Return a format string for a row of cells no wider than widths.
+        """
+        start, separator, end = self.line
+        cells = [u"{{:{}{}}}".format('>' if right else '<', width)
+                 for width, right in zip(widths, numeric)]
+        return start + separator.join(cells) + end
+
+    def lines(self, result):
+        """
+        Yield the headers, then each row of the result, then a count of
+        the rows.
+        """
+        rows = iter(result)
+        sample = list(itertools.islice(rows, self.sample))
+        widths, numeric = self.measure(result.names, sample)
+
+        template = self.template(widths, numeric)
+        headers = [truncate(cellText(name), width)
+                   for name, width in zip(result.names, widths)]
+        yield template.format(*headers).rstrip()
+        if self.rule is not None:
+            start, separator, end, fill = self.rule
+            yield start + separator.join(fill * w for w in widths) + end
+
+        count = 0
+        for row in itertools.chain(sample, rows):
+            cells = [truncate(cellText(value), width)
+                     for value, width in zip(row, widths)]
+            yield template.format(*cells).rstrip()
+            count += 1
+        yield u"{} rows".format(count)
@@ -1,21 +1,125 @@
 import os
 import shlex
+import threading
 import subprocess
+from multiprocessing.pool import ThreadPool
 
 import jinja2
-from jinja2 import meta
+from jinja2 import meta, nodes
 
+from mark.cache import cacheDirectory, cacheKey, makeDirectory
+from mark.timing import timings
 from mark.errors import MarkfileError, TemplateVariableError
 
-def popen(command):
+def runCommand(command, timeout=None):
+    """
+    Return the output of command, killing it after timeout seconds.
+    """
+    process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+    output, _ = process.communicate()
+    if timer is not None:
+        if not timer.is_alive():
+            msg = "`{}` timed out after {} seconds"
+            raise MarkfileError(msg.format(command, timeout))
+        timer.cancel()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return output
+
+def commandOutput(env, command, ttl=None, timeout=None):
+    """
+    Return the output of command, from the environment's popen cache if it
+    was run less than ttl seconds ago.
+    """
+    cache = env.popen_cache if ttl else None
+    if cache is not None:
+        key = cacheKey(command)
+        output = cache.get(key, ttl)
+        if output is not None:
+            return output
+    output = runCommand(command, timeout)
+    if cache is not None:
+        cache.set(key, output)
+    return output
+
+@jinja2.contextfilter
+def popen(context, command, volatile=False, ttl=None, timeout=None):
+    """
+    Return the output of command. Markfiles using volatile output are never
+    cached since it may change without the markfile changing. Output is
+    reused for ttl seconds if given.
+    """
+    # a context filter is never run at compile time, where jinja would
+    # constant-fold the output of a constant command into the bytecode
+    env = context.environment
+    if volatile:
+        env.volatile = True
+    if ttl:
+        # the rendered markfile is only good for the shortest ttl
+        env.ttl = min(env.ttl or ttl, ttl)
+    if command in env.prefetched:
+        return env.prefetched[command]
     try:
-        return subprocess.check_output(shlex.split(command))
+        with timings.phase('popen'):
+            return commandOutput(env, command, ttl, timeout)
     except Exception as e:
+        # don't cache a markfile rendered without the command's output
+        env.volatile = True
         print "Warning, template subprocess failed:", e
 
+def findCommands(env, source):
+    """
+    Return the command and constant keyword arguments of each `popen` filter
+    applied to a constant string in the template source.
+    """
+    commands = {}
+    for node in env.parse(source).find_all(nodes.Filter):
+        if node.name != 'popen' or not isinstance(node.node, nodes.Const):
+            continue
+        options = dict((keyword.key, keyword.value.value)
+                       for keyword in node.kwargs
+                       if isinstance(keyword.value, nodes.Const))
+        commands[node.node.value] = (options.get('ttl'),
+                                     options.get('timeout'))
+    return commands
+
+def prefetchCommands(env, source):
+    """
+    Run the commands of every `popen` filter in the template source at once,
+    so rendering takes as long as the slowest command rather than all of
+    them. Their output is used when the filters are rendered.
+    """
+    commands = findCommands(env, source)
+    if not commands:
+        return
+
+    def fetch(command):
+        ttl, timeout = commands[command]
+        try:
+            return command, commandOutput(env, command, ttl, timeout)
+        except Exception:
+            # the filter will run the command again and report the failure
+            return command, None
+
+    workers = ThreadPool(len(commands))
+    try:
+        with timings.phase('popen'):
+            results = workers.map(fetch, commands.keys())
+    finally:
+        workers.terminate()
+    env.prefetched.update((command, output) for command, output in results
+                          if output is not None)
 
 class MarkfileLoader(jinja2.BaseLoader):
 
+    def __init__(self):
+        # maps the path of every loaded template to its (mtime, source)
+        self.sources = {}
+
     def findFilename(self, filename, path=os.getcwd()):
         """
         Recursively search parent directories for the named file.
@@ -37,6 +141,7 @@ class MarkfileLoader(jinja2.BaseLoader):
         mtime = os.path.getmtime(path)
         with file(path) as f:
             source = f.read().decode('utf-8')
+        self.sources[path] = (mtime, source)
         return source, path, lambda: mtime == os.path.getmtime(path)
 
 def makeEnvironment(strict=False, **kwargs):
@@ -49,15 +154,66 @@ def makeEnvironment(strict=False, **kwargs):
 
     env = jinja2.Environment(**kwargs)
     env.filters['popen'] = popen
+    env.volatile = False
+    env.ttl = None
+    # output of prefetched and cached `popen` commands
+    env.prefetched = {}
+    env.popen_cache = None
     return env
 
+def makeBytecodeCache():
+    """
+    Return a Jinja2 bytecode cache stored in the user's cache directory.
+    """
+    path = cacheDirectory('templates')
+    makeDirectory(path)
+    return jinja2.FileSystemBytecodeCache(path)
+
+def compileTemplate(env, source, ast=None):
+    """
+    Return a Template for the source string, compiled from its ast if it
+    has already been parsed. If the environment has a bytecode cache the
+    compiled code is loaded from or stored in it.
+    """
+    parsed = source if ast is None else ast
+    cache = env.bytecode_cache
+    if cache is None:
+        return env.template_class.from_code(env, env.compile(parsed),
+                                            env.make_globals(None))
+    name = cacheKey(source)
+    bucket = cache.get_bucket(env, name, None, source)
+    code = bucket.code
+    if code is None:
+        code = env.compile(parsed, name)
+        bucket.code = code
+        cache.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+def findVariables(ast, source):
+    """
+    Return the variables referenced in the parsed template, in the order
+    they first appear in its source.
+    """
+    variables = meta.find_undeclared_variables(ast)
+    return sorted(variables, key=source.find)
+
 def parseVariables(env, source):
     """
     Return the variables referenced in the source Jinja2 template string.
     """
-    ast = env.parse(source)
-    variables = list(meta.find_undeclared_variables(ast))
-    return sorted(variables, cmp=lambda a,b: cmp(source.find(a), source.find(b)))
+    return findVariables(env.parse(source), source)
+
+class CompiledTemplate(object):
+    """
+    A template source parsed once, for both its variables and its compiled
+    Template, so it can be rendered any number of times.
+    """
+
+    def __init__(self, env, source):
+        ast = env.parse(source)
+        self.source = source
+        self.variables = findVariables(ast, source)
+        self.template = compileTemplate(env, source, ast)
 
 def drainParameters(variables, args, kwargs):
     """
@@ -72,21 +228,19 @@ def drainParameters(variables, args, kwargs):
             context[name] = kwargs.pop(unicode(name))
     return context
 
-def callTemplate(env, source, args, kwargs):
+def callTemplate(compiled, args, kwargs):
     """
-    Attempt to render a template in strict-mode by utilizing args and kwargs for
-    the context of the template. Variables not filled will raise a
+    Attempt to render a CompiledTemplate in strict-mode by utilizing args and
+    kwargs for the context of the template. Variables not filled will raise a
     TemplateVariableError.
 
     Variables are referenced in the template with [ ] rather than {{ }}.
     """
     args, kwargs = list(args), dict(kwargs)
-    variables = parseVariables(env, source)
-    context = drainParameters(variables, args, kwargs)
-    template = env.from_string(source)
+    context = drainParameters(compiled.variables, args, kwargs)
 
     try:
-        return template.render(**context)
+        return compiled.template.render(**context)
     except jinja2.exceptions.UndefinedError as e:
         # extract the missing variable from the error message
         attribute = e.message.split()[0].replace("'", "")
@@ -94,3 +248,28 @@ def callTemplate(env, source, args, kwargs):
         error = TemplateVariableError(msg.format(attribute))
         error.variable = attribute
         raise error
+
+def bindTemplate(compiled, args, kwargs, bound=None):
+    """
+    Render a CompiledTemplate with each variable replaced by a positional bind
+    parameter ($1, $2, ...) rather than its value. Return the rendered source
+    along with the value for each parameter, consumed from args and kwargs.
+    Variables named in `bound` are instead replaced by the expression they
+    map to. Variables not filled will raise a TemplateVariableError.
+    """
+    args, kwargs = list(args), dict(kwargs)
+    bound = bound or {}
+    variables = [v for v in compiled.variables if v not in bound]
+    context = drainParameters(variables, args, kwargs)
+
+    placeholders, values = dict(bound), []
+    for name in variables:
+        if name not in context:
+            msg = "Template requires missing `{}` variable."
+            error = TemplateVariableError(msg.format(name))
+            error.variable = name
+            raise error
+        values.append(context[name])
+        placeholders[name] = "${}".format(len(values))
+
+    return compiled.template.render(**placeholders), values
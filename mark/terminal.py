@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+
+from blessings import Terminal
+
+class ClientTerminal(Terminal):
+    """
+    Describes another process's terminal, such as that of a client of the
+    daemon, by its width and whether it is a terminal at all.
+    """
+
+    def __init__(self, width=None, is_a_tty=False):
+        Terminal.__init__(self, force_styling=True if is_a_tty else None)
+        self._is_a_tty = is_a_tty
+        self.client_width = width
+
+    @property
+    def width(self):
+        return self.client_width
+
+class ThreadTerminal(object):
+    """
+    Stands in for the Terminal output is rendered for, which is stdout's
+    unless the current thread is rendering for another one.
+    """
+
+    def __init__(self):
+        self.default = Terminal()
+        self.local = threading.local()
+
+    def current(self):
+        return getattr(self.local, 'terminal', None) or self.default
+
+    @contextmanager
+    def using(self, terminal):
+        """
+        Render for terminal in the current thread within the block.
+        """
+        previous = getattr(self.local, 'terminal', None)
+        self.local.terminal = terminal
+        try:
+            yield
+        finally:
+            self.local.terminal = previous
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+# the terminal every module renders for
+terminal = ThreadTerminal()
@@ -0,0 +1,127 @@
+import sys
+import time
+import json
+import resource
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from mark.errors import CLIError
+
+class Timings(object):
+    """
+    Records the time spent in named phases of a run along with counters such
+    as rows fetched. Phases may nest, in which case time spent in an inner
+    phase is not counted towards the outer one.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+
+    def add(self, mapping, name, amount):
+        with self.lock:
+            mapping[name] = mapping.get(name, 0) + amount
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.local.__dict__.setdefault('stack', [])
+        now = time.time()
+        if stack:
+            # pause the enclosing phase
+            outer, started = stack[-1]
+            self.add(self.phases, outer, now - started)
+        stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.time()
+            _, started = stack.pop()
+            self.add(self.phases, name, now - started)
+            if stack:
+                stack[-1] = (stack[-1][0], now)
+
+    def count(self, name, amount=1):
+        self.add(self.counters, name, amount)
+
+    def asDict(self):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {
+            'total': time.time() - self.started,
+            'phases': dict(self.phases),
+            'counters': dict(self.counters, peak_rss_kb=peak),
+        }
+
+    def report(self):
+        """
+        Return a human readable breakdown of the phases and counters.
+        """
+        data = self.asDict()
+        total = data['total']
+        width = max([len(name) for name in self.phases] + [5])
+        lines = []
+        for name, elapsed in self.phases.items():
+            share = 100.0 * elapsed / total if total else 0.0
+            lines.append("{}  {:>9.3f}s  {:>5.1f}%".format(
+                name.ljust(width), elapsed, share))
+        lines.append("{}  {:>9.3f}s".format('total'.ljust(width), total))
+        for name, value in data['counters'].items():
+            lines.append("{}  {:>10}".format(name.ljust(width), value))
+        return "\n".join(lines)
+
+    def dump(self, stream):
+        json.dump(self.asDict(), stream, sort_keys=True)
+        stream.write("\n")
+
+# timings for the current process, only reported when enabled
+timings = Timings()
+
+def valueBytes(value):
+    # binary values such as bytea aren't text
+    if isinstance(value, (str, buffer)):
+        return len(value)
+    return len(unicode(value))
+
+def rowBytes(rows):
+    """
+    Estimate the size of rows as the length of their values' text, or of
+    the bytes of binary values.
+    """
+    return sum(valueBytes(value) for row in rows for value in row)
+
+@contextmanager
+def profiling(mode, stream=sys.stderr, limit=30):
+    """
+    Profile the enclosed code, printing the most expensive functions for
+    `cpu` or the largest allocation sites for `memory` afterwards.
+    """
+    if mode == 'cpu':
+        import cProfile, pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(limit)
+    elif mode == 'memory':
+        try:
+            import tracemalloc
+        except ImportError:
+            msg = "Memory profiling requires the tracemalloc module."
+            raise CLIError(msg)
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for stat in snapshot.statistics('lineno')[:limit]:
+                stream.write("{}\n".format(stat))
+    else:
+        yield
@@ -1,12 +1,8 @@
-from collections import defaultdict
+import importlib
+import threading
+from collections import OrderedDict
 
-import sqlparse
-
-from blessings import Terminal
-t = Terminal()
-
-from mark.template import makeEnvironment, parseVariables
-from mark.errors import QueryError
+from mark.errors import CLIError
 
 def _escapeSplit(sep, argstr):
     """
@@ -55,7 +51,73 @@ def parseArgumentCall(call):
                 args.append(result[0])
     return call, args, kwargs
 
+def parseSweep(sweeps):
+    """
+    Parse parameter sweeps from the command-line into an ordered mapping of
+    parameter names to their list of values.
+
+    Example:
+    ['host=a,b', 'db=x'] => {'host': ['a', 'b'], 'db': ['x']}
+    """
+    parsed = OrderedDict()
+    for sweep in sweeps:
+        if '=' not in sweep:
+            msg = "Sweep `{}` must look like NAME=VALUE1,VALUE2"
+            raise CLIError(msg.format(sweep))
+        name, values = sweep.split('=', 1)
+        parsed[name] = _escapeSplit(',', values)
+    return parsed
+
 def pad(string, padding, align="<"):
     return ("{:" + str(align) + str(padding) + "}").format(string)
 
 
+
+class LazyModule(object):
+    """
+    Stand-in for a module which is only imported once one of its attributes
+    is used, keeping heavy dependencies off paths which never need them.
+
+    Example:
+    sqlparse = LazyModule('sqlparse')
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most `max_size` entries, evicting the
+    least recently used entry to make room for a new one.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            # move the entry to the most recently used end
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
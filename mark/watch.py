@@ -0,0 +1,46 @@
+import sys
+import time
+
+def redraw(term, previous, lines):
+    """
+    Draw lines on the terminal, only rewriting those which differ from the
+    previously drawn lines and clearing any left over.
+    """
+    for index, line in enumerate(lines):
+        if index < len(previous) and previous[index] == line:
+            continue
+        sys.stdout.write(term.move(index, 0) + line + term.clear_eol)
+    for index in range(len(lines), len(previous)):
+        sys.stdout.write(term.move(index, 0) + term.clear_eol)
+    sys.stdout.flush()
+
+def watch(term, render, interval):
+    """
+    Call render every interval seconds and draw its output in place until
+    interrupted.
+    """
+    previous = []
+    with term.fullscreen(), term.hidden_cursor():
+        try:
+            while True:
+                header = "Every {}s: {}".format(interval, time.strftime('%c'))
+                lines = [term.bold(header), ""] + render().splitlines()
+                redraw(term, previous, lines)
+                previous = lines
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+def preview(term, frames):
+    """
+    Draw the lines of each frame in place as it is produced, until there
+    are no more frames or Ctrl-C is pressed.
+    """
+    previous = []
+    with term.fullscreen(), term.hidden_cursor():
+        try:
+            for lines in frames:
+                redraw(term, previous, lines)
+                previous = lines
+        except KeyboardInterrupt:
+            pass
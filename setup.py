@@ -12,7 +12,7 @@ setup(
     packages=['mark'],
     install_requires=[
         'click',
-        'bashplotlib',
+        'numpy',
         'blessings',
         'psycopg2',
         'tabulate',
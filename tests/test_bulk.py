@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from decimal import Decimal
+from collections import namedtuple
+
+from mark.bulk import CopyDecoder, unescapeField, planEstimate
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+class UnescapeFieldTest(unittest.TestCase):
+
+    # (field in COPY's text format, decoded field)
+    cases = [
+        ("plain", "plain"),
+        ("", ""),
+        ("a\\tb\\nc", "a\tb\nc"),
+        ("back\\\\slash", "back\\slash"),
+        ("\\b\\f\\r\\v", "\b\f\r\v"),
+        ("\\101\\7", "A\x07"),
+        ("\\x41\\x4", "A\x04"),
+        # unknown escapes stand for the character itself
+        ("\\q", "q"),
+        ("caf\xc3\xa9", "caf\xc3\xa9"),
+    ]
+
+    def test_cases(self):
+        for field, expected in self.cases:
+            self.assertEqual(unescapeField(field), expected, field)
+
+class CopyDecoderTest(unittest.TestCase):
+
+    description = [Column('id', 23), Column('name', 99999),
+                   Column('score', 701), Column('total', 1700)]
+
+    # (chunks of COPY output, decoded columns)
+    cases = [
+        (["1\tcaf\xc3\xa9\t1.5\t10.25\n2\t\\N\t\\N\t\\N\n"],
+         [[1, 2], [u"café", None], [1.5, None], [Decimal('10.25'), None]]),
+        # lines split across chunks
+        (["1\ta", "b\t2", "\t3\n", "4\t\\tc\\\\\t-1", "\t0\n"],
+         [[1, 4], [u"ab", u"\tc\\"], [2.0, -1.0],
+          [Decimal(3), Decimal(0)]]),
+        ([], [[], [], [], []]),
+    ]
+
+    def test_cases(self):
+        for chunks, expected in self.cases:
+            decoder = CopyDecoder(self.description, None)
+            for chunk in chunks:
+                decoder.write(chunk)
+            result = decoder.result()
+            self.assertEqual(result.names, ['id', 'name', 'score', 'total'])
+            self.assertEqual(result.columns, expected, chunks)
+
+class PlanEstimateTest(unittest.TestCase):
+
+    plan = [{'Plan': {'Node Type': 'Seq Scan', 'Total Cost': 155.5,
+                      'Plan Rows': 1200}}]
+
+    def test_cases(self):
+        for plan in (self.plan, json.dumps(self.plan)):
+            self.assertEqual(planEstimate(plan), (155.5, 1200))
+
+if __name__ == '__main__':
+    unittest.main()
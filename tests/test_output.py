@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import io
+import uuid
+import decimal
+import datetime
+import unittest
+from StringIO import StringIO
+
+from mark.errors import CLIError
+from mark.output import writeJSONLines, writeCSV, writeArrow
+from mark.result import Result, ColumnResult
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+class WriteJSONLinesTest(unittest.TestCase):
+
+    # (names, rows, output)
+    cases = [
+        (['a', 'b'], [(1, u"x"), (None, u"café")],
+         '{"a": 1, "b": "x"}\n{"a": null, "b": "caf\\u00e9"}\n'),
+        (['t', 'd'], [(datetime.datetime(2020, 1, 2, 3, 4, 5),
+                       decimal.Decimal('1.5'))],
+         '{"t": "2020-01-02T03:04:05", "d": 1.5}\n'),
+        (['e', 'u'], [(datetime.timedelta(minutes=1),
+                       uuid.UUID(int=1))],
+         '{"e": 60.0, "u": "00000000-0000-0000-0000-000000000001"}\n'),
+        (['a'], [], ''),
+    ]
+
+    def test_cases(self):
+        for names, rows, expected in self.cases:
+            out = StringIO()
+            writeJSONLines(Result(names, iter(rows)), out, batch_size=1)
+            self.assertEqual(out.getvalue(), expected, rows)
+
+class WriteCSVTest(unittest.TestCase):
+
+    # (names, rows, output)
+    cases = [
+        (['a', 'b'], [(1, u"x"), (None, u"café")],
+         'a,b\r\n1,x\r\n,caf\xc3\xa9\r\n'),
+        (['a'], [(u'say "hi", twice',)], 'a\r\n"say ""hi"", twice"\r\n'),
+        ([u'ü'], [], '\xc3\xbc\r\n'),
+    ]
+
+    def test_cases(self):
+        for names, rows, expected in self.cases:
+            out = StringIO()
+            writeCSV(Result(names, iter(rows)), out, batch_size=1)
+            self.assertEqual(out.getvalue(), expected, rows)
+
+@unittest.skipUnless(pyarrow, "requires pyarrow")
+class WriteArrowTest(unittest.TestCase):
+
+    # (result, column types, columns)
+    cases = [
+        # the type of a column comes from the first batch with a value
+        (Result(['a', 'b'], iter([(None, u"x"), (2, None), (3, u"y")])),
+         ['int64', 'string'], [[None, 2, 3], [u"x", None, u"y"]]),
+        (Result(['a'], iter([(None,), (None,)])),
+         ['null'], [[None, None]]),
+        (ColumnResult(['a', 'b'], [[1.5, None, 2.5], [u"x", u"y", u"z"]]),
+         ['double', 'string'], [[1.5, None, 2.5], [u"x", u"y", u"z"]]),
+    ]
+
+    def test_cases(self):
+        for result, types, columns in self.cases:
+            out = io.BytesIO()
+            writeArrow(result, out, batch_size=1)
+            table = pyarrow.ipc.open_stream(out.getvalue()).read_all()
+            self.assertEqual([str(field.type) for field in table.schema],
+                             types)
+            self.assertEqual([table.column(i).to_pylist()
+                              for i in range(table.num_columns)], columns)
+
+@unittest.skipIf(pyarrow, "pyarrow is installed")
+class WriteArrowMissingTest(unittest.TestCase):
+
+    def test_missing(self):
+        self.assertRaises(CLIError, writeArrow, Result(['a'], []),
+                          io.BytesIO())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from numpy.testing import assert_array_equal
+
+from mark.pivot import pivot
+from mark.result import Result
+
+nan = float('nan')
+
+class PivotTest(unittest.TestCase):
+
+    # (rows of partition, label and value, partitions, keys, matrix)
+    cases = [
+        ([('b', 2, 1), ('a', 1, 2), ('b', 1, 3)],
+         ['b', 'a'], [u'1', u'2'], [[3, 1], [2, 0]]),
+        # keys sort by value rather than as text
+        ([('a', 10, 1), ('a', 9, 2)],
+         ['a'], [u'9', u'10'], [[2, 1]]),
+        ([('a', 'y', 1), ('a', 'x', 2)],
+         ['a'], [u'x', u'y'], [[2, 1]]),
+        # ANSI escapes are stripped, merging the labels they decorate
+        ([('\x1b[31ma\x1b[0m', 'x', 1), ('a', '\x1b[1my\x1b[0m', 2)],
+         ['a'], [u'x', u'y'], [[1, 2]]),
+        # NULL values are NaN
+        ([('a', 1, None), ('a', 2, 4)],
+         ['a'], [u'1', u'2'], [[nan, 4]]),
+    ]
+
+    def test_cases(self):
+        for rows, partitions, keys, matrix in self.cases:
+            result = pivot(Result(['host', 'time', 'n'], iter(rows)),
+                           'host', 'time', 'n')
+            self.assertEqual(result.partitions, partitions, rows)
+            self.assertEqual(result.keys, keys, rows)
+            assert_array_equal(result.matrix, matrix)
+
+    def test_empty(self):
+        result = pivot(Result(['host', 'time', 'n'], []), 'host', 'time', 'n')
+        self.assertEqual((result.partitions, result.keys), ([], []))
+        self.assertEqual(result.matrix.shape, (0, 0))
+
+    def test_top(self):
+        rows = [('a', 1, 5), ('b', 1, 1), ('c', 1, 3), ('c', 2, 3)]
+        result = pivot(Result(['host', 'time', 'n'], rows),
+                       'host', 'time', 'n')
+        self.assertEqual(result.top(2).tolist(), [0, 2])
+        self.assertEqual(result.top(None).tolist(), [1, 0, 2])
+
+if __name__ == '__main__':
+    unittest.main()
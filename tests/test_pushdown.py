@@ -0,0 +1,90 @@
+import unittest
+
+from mark.errors import QueryError
+from mark.pushdown import pushdownQuery, watermarkQuery, limitQuery
+
+class Graph(object):
+    """
+    The attributes of a graph which pushdownQuery reads.
+    """
+
+    def __init__(self, pushdown='time', aggregate='max', unit=None,
+                 partition=None):
+        self.label = 'time'
+        self.axis = 'n'
+        self.pushdown = pushdown
+        self.aggregate = aggregate
+        self.unit = unit
+        self.partition = partition
+
+    def seriesWidth(self):
+        return 80
+
+class PushdownQueryTest(unittest.TestCase):
+
+    # (sql, graph, fragments of the bucketing query)
+    cases = [
+        # a trailing ; is dropped when the query is wrapped
+        ("select time, n from t;", Graph(unit='hour', aggregate='sum'),
+         ["with results as (select time, n from t), ",
+          "date_trunc('hour', results.\"time\") as \"time\"",
+          "sum(results.\"n\") as \"n\"",
+          "group by 1 order by 1"]),
+        ("select time, n from t", Graph(),
+         ["min(\"time\") as low, max(\"time\") as high from results",
+          "to_timestamp(floor(", "/ 80, 1)",
+          "max(results.\"n\") as \"n\""]),
+        ("select time, n from t", Graph(pushdown='numeric'),
+         ["width_bucket(results.\"time\", bounds.low, bounds.high, 80)"]),
+        ("select host, time, n from t", Graph(partition='host'),
+         ["select results.\"host\", ", "group by 1, 2 order by 1, 2"]),
+    ]
+
+    def test_cases(self):
+        for sql, graph, fragments in self.cases:
+            pushed = pushdownQuery(sql, graph)
+            for fragment in fragments:
+                self.assertIn(fragment, pushed)
+            self.assertNotIn(";", pushed)
+
+    def test_invalid(self):
+        self.assertRaises(QueryError, pushdownQuery, "select time, n from t",
+                          Graph(aggregate='median'))
+        self.assertRaises(QueryError, pushdownQuery, "select time, n from t",
+                          Graph(pushdown='hourly'))
+
+class WatermarkQueryTest(unittest.TestCase):
+
+    # (sql, watermark column, bind parameter, watermarked sql)
+    cases = [
+        ("select t, n from x", 't', 1,
+         "select * from (select t, n from x) as results "
+         "where results.\"t\" >= $1 order by results.\"t\""),
+        (" select t, n from x; \n", 't', 3,
+         "select * from (select t, n from x) as results "
+         "where results.\"t\" >= $3 order by results.\"t\""),
+        ("select \"a\"\"b\", n from x", 'a"b', 2,
+         "select * from (select \"a\"\"b\", n from x) as results "
+         "where results.\"a\"\"b\" >= $2 order by results.\"a\"\"b\""),
+    ]
+
+    def test_cases(self):
+        for sql, column, position, expected in self.cases:
+            self.assertEqual(watermarkQuery(sql, column, position), expected)
+
+class LimitQueryTest(unittest.TestCase):
+
+    # (sql, limit, limited sql)
+    cases = [
+        ("select t, n from x", 10,
+         "select * from (select t, n from x) as results limit 10"),
+        ("select t, n from x limit 500;\n", 5,
+         "select * from (select t, n from x limit 500) as results limit 5"),
+    ]
+
+    def test_cases(self):
+        for sql, limit, expected in self.cases:
+            self.assertEqual(limitQuery(sql, limit), expected)
+
+if __name__ == '__main__':
+    unittest.main()
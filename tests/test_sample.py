@@ -0,0 +1,59 @@
+import unittest
+
+from mark.sample import sampleQuery, estimatedColumns
+
+class SampleQueryTest(unittest.TestCase):
+
+    # (sql, sampled sql at 1%, or None if it can't be sampled)
+    cases = [
+        ("select a, b from t",
+         "select a, b from t tablesample system (1)"),
+        ("select a, b from t;",
+         "select a, b from t tablesample system (1)"),
+        ("select a, b from t e where e.a > 1",
+         "select a, b from t e tablesample system (1) where e.a > 1"),
+        ("select a, b from public.events as ev group by a",
+         "select a, b from public.events as ev tablesample system (1) "
+         "group by a"),
+        ("select host, count(*) from events group by host order by 2 limit 5",
+         "select host, count(*) from events tablesample system (1) "
+         "group by host order by 2 limit 5"),
+        ("select extract(epoch from t) as e, b from logs "
+         "where x in (select 1 from y)",
+         "select extract(epoch from t) as e, b from logs "
+         "tablesample system (1) where x in (select 1 from y)"),
+        ("select a, b from t1 join t2 on t1.id = t2.id", None),
+        ("select a, b from t1 left join t2 using (id)", None),
+        ("select a, b from t1, t2", None),
+        ("with x as (select 1) select a, b from x", None),
+        ("select a, b from (select 1) s", None),
+        ("select a, b from generate_series(1, 2) g", None),
+        ("select a, b from x union select a, b from y", None),
+        ("select a, b from t tablesample bernoulli (5)", None),
+        ("select 1, 2", None),
+    ]
+
+    def test_cases(self):
+        for sql, expected in self.cases:
+            self.assertEqual(sampleQuery(sql, 1), expected, sql)
+
+    def test_percentage(self):
+        self.assertEqual(sampleQuery("select a, b from t", 0.1),
+                         "select a, b from t tablesample system (0.1)")
+
+class EstimatedColumnsTest(unittest.TestCase):
+
+    # (sql, names of the columns scaled up in a sample)
+    cases = [
+        ("select host, count(*) as n, sum(x), COUNT(distinct y) c, avg(z) "
+         "from events", [u'n', u'sum', u'c']),
+        ("select a, max(b) from t", []),
+        ("select a, b from t", []),
+    ]
+
+    def test_cases(self):
+        for sql, expected in self.cases:
+            self.assertEqual(estimatedColumns(sql), expected, sql)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from mark.shards import orderBy, mergeOrdered, reaggregate
+from mark.result import Result
+
+class OrderByTest(unittest.TestCase):
+
+    names = ['host', 'n']
+
+    # (sql, (order terms, limit))
+    cases = [
+        ("select host, n from t order by n desc limit 10",
+         ([(1, True)], 10)),
+        ("select host, n from t order by 2, 1 desc;",
+         ([(1, False), (0, True)], None)),
+        ("select host, n from t order by t.n desc, \"host\" limit 3",
+         ([(1, True), (0, False)], 3)),
+        ("select host, n from t order by host asc",
+         ([(0, False)], None)),
+        ("select host, n from t order by 3", (None, None)),
+        ("select host, n from t order by lower(host)", (None, None)),
+        ("select host, n from t limit 5", (None, 5)),
+        ("select host, n from t", (None, None)),
+    ]
+
+    def test_cases(self):
+        for sql, expected in self.cases:
+            self.assertEqual(orderBy(sql, self.names), expected, sql)
+
+class MergeOrderedTest(unittest.TestCase):
+
+    shards = [('one', [('a', 5), ('c', 1)]), ('two', [('b', 9), ('d', 0)])]
+
+    # (order terms, limit, shard column, merged rows)
+    cases = [
+        ([(0, False)], None, None, [('a', 5), ('b', 9), ('c', 1), ('d', 0)]),
+        ([(1, True)], None, None, [('b', 9), ('a', 5), ('c', 1), ('d', 0)]),
+        ([(0, False)], 3, None, [('a', 5), ('b', 9), ('c', 1)]),
+        ([(0, False)], 2, 'shard', [('one', 'a', 5), ('two', 'b', 9)]),
+    ]
+
+    def test_cases(self):
+        for order, limit, column, expected in self.cases:
+            results = [(label, Result(['host', 'n'], iter(rows)))
+                       for label, rows in self.shards]
+            merged = mergeOrdered(results, order, limit, column)
+            self.assertEqual(list(merged), expected, (order, limit, column))
+
+class ReaggregateTest(unittest.TestCase):
+
+    rows = [('a', 1), ('b', None), ('a', 4), ('b', 2), ('c', None)]
+
+    # (aggregator, combined rows)
+    cases = [
+        ('sum', [('a', 5), ('b', 2), ('c', None)]),
+        ('min', [('a', 1), ('b', 2), ('c', None)]),
+        ('max', [('a', 4), ('b', 2), ('c', None)]),
+    ]
+
+    def test_cases(self):
+        for how, expected in self.cases:
+            result = reaggregate(Result(['host', 'n'], self.rows), 'n', how)
+            self.assertEqual(list(result), expected, how)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+import numpy
+from numpy.testing import assert_array_equal
+
+from mark.sparkline import downsample
+
+nan = float('nan')
+
+class DownsampleTest(unittest.TestCase):
+
+    # (series, width, aggregate, downsampled series)
+    cases = [
+        ([1, 5, 2, 2, 7, 3], 3, 'max', [5, 2, 7]),
+        ([1, 5, 2, 2, 7, 3], 3, 'min', [1, 2, 3]),
+        ([1, 5, 2, 2, 7, 3], 3, 'sum', [6, 4, 10]),
+        ([1, 5, 2, 2, 7, 3], 3, 'mean', [3, 2, 5]),
+        ([1, 5, 2, 2, 7, 3], 3, 'last', [5, 2, 3]),
+        # buckets of uneven length
+        ([1, 2, 3, 4, 5], 2, 'sum', [3, 12]),
+        # NaN is ignored unless the whole bucket is NaN
+        ([nan, nan, 1, nan], 2, 'max', [nan, 1]),
+        ([nan, nan, 1, nan], 2, 'min', [nan, 1]),
+        ([nan, nan, 1, nan], 2, 'mean', [nan, 1]),
+        ([nan, nan, 1, nan], 2, 'sum', [0, 1]),
+        # series no longer than width are left alone
+        ([1, 2, 3], 3, 'max', [1, 2, 3]),
+        ([1, 2, 3], 80, 'sum', [1, 2, 3]),
+        # two dimensional series are downsampled along each row
+        ([[1, 2, 3, 4], [4, 3, 2, 1]], 2, 'max', [[2, 4], [4, 2]]),
+    ]
+
+    def test_cases(self):
+        for series, width, aggregate, expected in self.cases:
+            downsampled = downsample(numpy.array(series, dtype=float), width,
+                                     aggregate)
+            assert_array_equal(downsampled, numpy.array(expected, dtype=float),
+                               "{} {}".format(series, aggregate))
+
+if __name__ == '__main__':
+    unittest.main()
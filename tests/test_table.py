@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mark.table import StreamingTable, cellText, truncate
+from mark.result import Result
+
+class CellTextTest(unittest.TestCase):
+
+    # (value, text of its cell)
+    cases = [
+        (None, u""),
+        (12, u"12"),
+        (u"café", u"café"),
+        ("caf\xc3\xa9", u"café"),
+        ("\xff", u"�"),
+        (u"a\nb\tc\rd", u"a b c d"),
+    ]
+
+    def test_cases(self):
+        for value, expected in self.cases:
+            self.assertEqual(cellText(value), expected, repr(value))
+
+    def test_truncate(self):
+        self.assertEqual(truncate(u"abcdef", 6), u"abcdef")
+        self.assertEqual(truncate(u"abcdef", 4), u"abc…")
+
+class StreamingTableTest(unittest.TestCase):
+
+    # (table arguments, names, rows, lines of the table)
+    cases = [
+        (dict(tablefmt='orgtbl'), ['host', 'n'], [('a', 1), ('bb', 22)],
+         [u"| host |  n |",
+          u"|------+----|",
+          u"| a    |  1 |",
+          u"| bb   | 22 |",
+          u"2 rows"]),
+        (dict(tablefmt='simple'), ['host', 'n'], [('a', None), ('b', 3)],
+         [u"host  n",
+          u"----  -",
+          u"a",
+          u"b     3",
+          u"2 rows"]),
+        (dict(tablefmt='plain'), ['x'], [], [u"x", u"0 rows"]),
+        # widths come from the sampled rows, and longer values are cut
+        (dict(tablefmt='plain', sample=1), ['x'], [('ab',), ('abcd',)],
+         [u"x", u"ab", u"a…", u"2 rows"]),
+        (dict(tablefmt='plain', column_width=3), ['name'], [('abcdef',)],
+         [u"na…", u"ab…", u"1 rows"]),
+    ]
+
+    def test_cases(self):
+        for options, names, rows, expected in self.cases:
+            table = StreamingTable(**options)
+            lines = list(table.lines(Result(names, iter(rows))))
+            self.assertEqual(lines, expected, rows)
+
+if __name__ == '__main__':
+    unittest.main()